@@ -1,16 +1,149 @@
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from app.config import settings
 import logging
+import re
 from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
 
+# Twilio statuses worth retrying (throttles and transient server errors)
+_RETRYABLE_STATUSES = (429, 500, 502, 503)
+
+# Emoji labels force UCS-2 encoding, dropping the per-segment limit from 160
+# to 70 chars (usually doubling segment count and cost). Messages default to
+# the GSM-7 plain-label template; the emoji variant is only used when a
+# dynamic field already forces UCS-2 anyway.
+_NON_GSM_RE = re.compile(r"[^\x00-\x7f]")
+
+_RESERVATION_TPL_GSM = """Thank you for your reservation at {restaurant_name}!
+
+Date: {date}
+Time: {time}
+Party Size: {party_size}
+Confirmation: {confirmation_number}
+
+We look forward to serving you! Please call us if you need to make any changes.
+
+{restaurant_name}
+{from_number}"""
+
+_RESERVATION_TPL_UNI = """Thank you for your reservation at {restaurant_name}!
+
+📅 Date: {date}
+🕐 Time: {time}
+👥 Party Size: {party_size}
+📞 Confirmation: {confirmation_number}
+
+We look forward to serving you! Please call us if you need to make any changes.
+
+{restaurant_name}
+{from_number}"""
+
+_WAITLIST_TPL_GSM = """You've been added to the waitlist at {restaurant_name}!
+
+Date: {date}
+Requested Time: {time}
+Party Size: {party_size}
+Estimated Wait: {estimated_wait_time} minutes
+
+We'll call you when a table becomes available!
+
+{restaurant_name}
+{from_number}"""
+
+_WAITLIST_TPL_UNI = """You've been added to the waitlist at {restaurant_name}!
+
+📅 Date: {date}
+🕐 Requested Time: {time}
+👥 Party Size: {party_size}
+⏱️ Estimated Wait: {estimated_wait_time} minutes
+
+We'll call you when a table becomes available!
+
+{restaurant_name}
+{from_number}"""
+
+_REMINDER_TPL_GSM = """Reminder: Your reservation at {restaurant_name} is today!
+
+Date: {date}
+Time: {time}
+Party Size: {party_size}
+
+We look forward to seeing you!
+
+{restaurant_name}
+{from_number}"""
+
+_REMINDER_TPL_UNI = """Reminder: Your reservation at {restaurant_name} is today!
+
+📅 Date: {date}
+🕐 Time: {time}
+👥 Party Size: {party_size}
+
+We look forward to seeing you!
+
+{restaurant_name}
+{from_number}"""
+
+_CANCELLATION_TPL_GSM = """Your reservation at {restaurant_name} has been cancelled.
+
+Date: {date}
+Time: {time}
+Party Size: {party_size}
+
+We hope to see you again soon!
+
+{restaurant_name}
+{from_number}"""
+
+_CANCELLATION_TPL_UNI = """Your reservation at {restaurant_name} has been cancelled.
+
+📅 Date: {date}
+🕐 Time: {time}
+👥 Party Size: {party_size}
+
+We hope to see you again soon!
+
+{restaurant_name}
+{from_number}"""
+
+
+def _render_template(gsm_template: str, unicode_template: str, fields: Dict[str, Any]) -> str:
+    """
+    Render the GSM-7 template unless a dynamic field already forces UCS-2
+    """
+    if any(_NON_GSM_RE.search(str(value)) for value in fields.values()):
+        return unicode_template.format(**fields)
+    return gsm_template.format(**fields)
+
+
+def _is_retryable_twilio_error(exc: BaseException) -> bool:
+    return isinstance(exc, TwilioRestException) and exc.status in _RETRYABLE_STATUSES
+
 
 class SMSService:
     def __init__(self):
         self.client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
         self.from_number = settings.twilio_phone_number
-    
+
+    @retry(
+        retry=retry_if_exception(_is_retryable_twilio_error),
+        wait=wait_exponential_jitter(initial=0.25, max=4),
+        stop=stop_after_attempt(4),
+        reraise=True,
+    )
+    def _send_message(self, to_number: str, body: str):
+        """
+        Send an SMS through Twilio, retrying transient API failures with backoff
+        """
+        return self.client.messages.create(
+            body=body,
+            from_=self.from_number,
+            to=to_number
+        )
+
     async def send_reservation_confirmation(self, to_number: str, reservation_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Send reservation confirmation SMS
@@ -20,11 +153,7 @@ class SMSService:
             message_body = self._format_reservation_confirmation(reservation_data)
             
             # Send SMS
-            message = self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=to_number
-            )
+            message = self._send_message(to_number, message_body)
             
             return {
                 "success": True,
@@ -43,21 +172,15 @@ class SMSService:
         """
         Format reservation confirmation message
         """
-        restaurant_name = settings.restaurant_name
-        
-        message = f"""Thank you for your reservation at {restaurant_name}!
-
-📅 Date: {reservation_data.get('date', 'N/A')}
-🕐 Time: {reservation_data.get('time', 'N/A')}
-👥 Party Size: {reservation_data.get('party_size', 'N/A')}
-📞 Confirmation: {reservation_data.get('confirmation_number', 'N/A')}
-
-We look forward to serving you! Please call us if you need to make any changes.
-
-{restaurant_name}
-{settings.twilio_phone_number}"""
-        
-        return message
+        fields = {
+            "restaurant_name": settings.restaurant_name,
+            "from_number": settings.twilio_phone_number,
+            "date": reservation_data.get('date', 'N/A'),
+            "time": reservation_data.get('time', 'N/A'),
+            "party_size": reservation_data.get('party_size', 'N/A'),
+            "confirmation_number": reservation_data.get('confirmation_number', 'N/A'),
+        }
+        return _render_template(_RESERVATION_TPL_GSM, _RESERVATION_TPL_UNI, fields)
     
     async def send_waitlist_confirmation(self, to_number: str, waitlist_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -68,11 +191,7 @@ We look forward to serving you! Please call us if you need to make any changes.
             message_body = self._format_waitlist_confirmation(waitlist_data)
             
             # Send SMS
-            message = self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=to_number
-            )
+            message = self._send_message(to_number, message_body)
             
             return {
                 "success": True,
@@ -91,21 +210,15 @@ We look forward to serving you! Please call us if you need to make any changes.
         """
         Format waitlist confirmation message
         """
-        restaurant_name = settings.restaurant_name
-        
-        message = f"""You've been added to the waitlist at {restaurant_name}!
-
-📅 Date: {waitlist_data.get('date', 'N/A')}
-🕐 Requested Time: {waitlist_data.get('time', 'N/A')}
-👥 Party Size: {waitlist_data.get('party_size', 'N/A')}
-⏱️ Estimated Wait: {waitlist_data.get('estimated_wait_time', 'N/A')} minutes
-
-We'll call you when a table becomes available!
-
-{restaurant_name}
-{settings.twilio_phone_number}"""
-        
-        return message
+        fields = {
+            "restaurant_name": settings.restaurant_name,
+            "from_number": settings.twilio_phone_number,
+            "date": waitlist_data.get('date', 'N/A'),
+            "time": waitlist_data.get('time', 'N/A'),
+            "party_size": waitlist_data.get('party_size', 'N/A'),
+            "estimated_wait_time": waitlist_data.get('estimated_wait_time', 'N/A'),
+        }
+        return _render_template(_WAITLIST_TPL_GSM, _WAITLIST_TPL_UNI, fields)
     
     async def send_reminder(self, to_number: str, reservation_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -116,11 +229,7 @@ We'll call you when a table becomes available!
             message_body = self._format_reminder(reservation_data)
             
             # Send SMS
-            message = self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=to_number
-            )
+            message = self._send_message(to_number, message_body)
             
             return {
                 "success": True,
@@ -139,20 +248,14 @@ We'll call you when a table becomes available!
         """
         Format reminder message
         """
-        restaurant_name = settings.restaurant_name
-        
-        message = f"""Reminder: Your reservation at {restaurant_name} is today!
-
-📅 Date: {reservation_data.get('date', 'N/A')}
-🕐 Time: {reservation_data.get('time', 'N/A')}
-👥 Party Size: {reservation_data.get('party_size', 'N/A')}
-
-We look forward to seeing you!
-
-{restaurant_name}
-{settings.twilio_phone_number}"""
-        
-        return message
+        fields = {
+            "restaurant_name": settings.restaurant_name,
+            "from_number": settings.twilio_phone_number,
+            "date": reservation_data.get('date', 'N/A'),
+            "time": reservation_data.get('time', 'N/A'),
+            "party_size": reservation_data.get('party_size', 'N/A'),
+        }
+        return _render_template(_REMINDER_TPL_GSM, _REMINDER_TPL_UNI, fields)
     
     async def send_cancellation_confirmation(self, to_number: str, reservation_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -163,11 +266,7 @@ We look forward to seeing you!
             message_body = self._format_cancellation_confirmation(reservation_data)
             
             # Send SMS
-            message = self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=to_number
-            )
+            message = self._send_message(to_number, message_body)
             
             return {
                 "success": True,
@@ -186,17 +285,11 @@ We look forward to seeing you!
         """
         Format cancellation confirmation message
         """
-        restaurant_name = settings.restaurant_name
-        
-        message = f"""Your reservation at {restaurant_name} has been cancelled.
-
-📅 Date: {reservation_data.get('date', 'N/A')}
-🕐 Time: {reservation_data.get('time', 'N/A')}
-👥 Party Size: {reservation_data.get('party_size', 'N/A')}
-
-We hope to see you again soon!
-
-{restaurant_name}
-{settings.twilio_phone_number}"""
-        
-        return message 
\ No newline at end of file
+        fields = {
+            "restaurant_name": settings.restaurant_name,
+            "from_number": settings.twilio_phone_number,
+            "date": reservation_data.get('date', 'N/A'),
+            "time": reservation_data.get('time', 'N/A'),
+            "party_size": reservation_data.get('party_size', 'N/A'),
+        }
+        return _render_template(_CANCELLATION_TPL_GSM, _CANCELLATION_TPL_UNI, fields) 
\ No newline at end of file
@@ -1,3 +1,4 @@
+import asyncio
 import openai
 from app.config import settings
 import logging
@@ -17,7 +18,10 @@ class WhisperService:
         Transcribe audio data using OpenAI Whisper API
         """
         try:
-            response = self.client.audio.transcriptions.create(
+            # The OpenAI SDK call is synchronous; run it in a worker thread so
+            # the event loop keeps servicing other calls during the round-trip
+            response = await asyncio.to_thread(
+                self.client.audio.transcriptions.create,
                 model="whisper-1",
                 file=("audio.wav", audio_data, "audio/wav"),
                 response_format="text"
@@ -32,7 +36,8 @@ class WhisperService:
         Transcribe a single audio chunk
         """
         try:
-            response = self.client.audio.transcriptions.create(
+            response = await asyncio.to_thread(
+                self.client.audio.transcriptions.create,
                 model="whisper-1",
                 file=("chunk.wav", audio_chunk, "audio/wav"),
                 response_format="text"
@@ -1,22 +1,32 @@
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, StreamingResponse
+import asyncio
+import html
+import io
 import os
 import json
 import logging
+import queue
 import re
+import tempfile
+import threading
 import time
+import uuid
 from typing import Optional, Dict, List
-from collections import defaultdict
+from collections import Counter, defaultdict, deque
+from functools import lru_cache
 from pydantic import BaseModel
+import httpx
 import openai
+from openai import AsyncOpenAI
 from elevenlabs import generate, save
 import elevenlabs
 
 # Database imports
 try:
-    from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey
+    from sqlalchemy import create_engine, case, Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey
     from sqlalchemy.ext.declarative import declarative_base
-    from sqlalchemy.orm import sessionmaker, relationship
+    from sqlalchemy.orm import sessionmaker, relationship, selectinload
     from sqlalchemy.sql import func
     import psycopg2
     DATABASE_AVAILABLE = True
@@ -24,11 +34,38 @@ except ImportError as e:
     logging.warning(f"Database dependencies not available: {e}")
     DATABASE_AVAILABLE = False
 
+# Guarded orjson import (faster JSON on the hot path)
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+except Exception:
+    orjson = None
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+
+def _json_response(content, status_code: int = 200) -> "Response":
+    """Error/status JSON response encoded via the fast serializer"""
+    return Response(
+        content=_json_dumps(content),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Restaurant Agent")
+# orjson serializes responses several times faster than the stdlib encoder
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse
+    app = FastAPI(title="Restaurant Agent", default_response_class=ORJSONResponse)
+else:
+    app = FastAPI(title="Restaurant Agent")
 
 # Load environment variables
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -53,6 +90,49 @@ except Exception:
     TwilioClient = None
     _twilio_import_ok = False
 
+# Guarded tenacity import (backoff around upstream vendor calls)
+try:
+    import tenacity
+    _tenacity_import_ok = True
+except Exception:
+    tenacity = None
+    _tenacity_import_ok = False
+
+# Guarded NumPy import (semantic cache vector math)
+try:
+    import numpy as np
+    _numpy_import_ok = True
+except Exception:
+    np = None
+    _numpy_import_ok = False
+
+# Guarded pyahocorasick import (single-pass multi-keyword scanning)
+try:
+    import ahocorasick
+    _ahocorasick_import_ok = True
+except Exception:
+    ahocorasick = None
+    _ahocorasick_import_ok = False
+
+# Guarded cachetools import (TTL-bounded security state)
+try:
+    from cachetools import TTLCache
+    _cachetools_import_ok = True
+except Exception:
+    TTLCache = None
+    _cachetools_import_ok = False
+
+# Guarded Redis import (optional; enables multi-worker call state). The
+# asyncio client keeps Redis round-trips off the event loop — the webhook
+# handlers touch call state several times per turn.
+try:
+    import redis.asyncio as redis_async
+    _redis_import_ok = True
+except Exception:
+    redis_async = None
+    _redis_import_ok = False
+
+
 # Database setup
 engine = None
 SessionLocal = None
@@ -61,8 +141,19 @@ Base = None
 if DATABASE_AVAILABLE and DATABASE_URL:
     try:
         Base = declarative_base()
-        engine = create_engine(DATABASE_URL)
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Sized for bursts of concurrent log writes; pre-ping/recycle avoid
+        # handing out connections the server has already closed
+        engine = create_engine(
+            DATABASE_URL,
+            pool_size=20,
+            max_overflow=10,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            future=True,
+        )
+        SessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+        )
         logger.info("Database connection established")
     except Exception as e:
         logger.warning(f"Database connection failed: {e}")
@@ -128,47 +219,94 @@ if DATABASE_AVAILABLE and Base is not None:
         logger.warning(f"Could not create database tables: {e}")
         DATABASE_AVAILABLE = False
 
+@lru_cache(maxsize=4096)
+def _detect_language_patterns(normalized: str):
+    """
+    Pattern-phase detection for a normalized utterance; None means no
+    keyword gave evidence and the API fallback is needed
+    """
+    # Both paths pick the language with the most keyword hits. They differ
+    # only in how ties break: the automaton counts in text-match order (and
+    # table order within a shared keyword's language tuple), the substring
+    # fallback in table order.
+    is_ascii = normalized.isascii()
+    automaton = _LANG_AUTOMATON_ASCII if is_ascii else _LANG_AUTOMATON
+    if automaton is not None:
+        hits = Counter()
+        for _, langs in automaton.iter(normalized):
+            hits.update(langs)
+        if hits:
+            return hits.most_common(1)[0][0]
+    else:
+        table = _ASCII_LANG_PATTERNS if is_ascii else LANGUAGE_PATTERNS
+        best_lang = None
+        best_matches = 0
+        for lang_code, patterns in table.items():
+            matches = sum(1 for pattern in patterns if pattern in normalized)
+            if matches > best_matches:
+                best_lang, best_matches = lang_code, matches
+        if best_lang is not None:
+            return best_lang
+    return None
+
+
+# API-detected languages keyed on normalized text (lru_cache does not mix
+# with coroutines, so this phase uses a plain capped dict)
+_lang_api_cache: Dict[str, str] = {}
+_LANG_API_CACHE_MAX = 4096
+
+
 # Language detection function
-def detect_language(text):
+async def detect_language(text, text_lower=None):
     """
     Detect language from customer input using keyword patterns and OpenAI
+
+    Repeated phrases (greetings, "yes", "no", ...) dominate call-center
+    traffic, so detections are cached on the normalized text and skip the
+    API round-trip entirely on a hit. The API fallback is awaited so the
+    event loop stays free during the network wait. Callers that already
+    lowercased the text pass it via text_lower to skip the second pass.
     """
-    text_lower = text.lower()
-    
-    # Quick pattern-based detection for common languages
-    for lang_code, patterns in LANGUAGE_PATTERNS.items():
-        matches = sum(1 for pattern in patterns if pattern in text_lower)
-        if matches >= 1:  # If we find at least one keyword match
-            return lang_code
-    
+    normalized = re.sub(r"\s+", " ", text_lower if text_lower is not None else text.lower()).strip()
+    detected = _detect_language_patterns(normalized)
+    if detected is not None:
+        return detected
+
+    cached = _lang_api_cache.get(normalized)
+    if cached is not None:
+        return cached
+
     # Fallback to OpenAI language detection for more complex cases
     try:
-        response = openai.ChatCompletion.create(
+        response = await _chat_completion_async(
             model="gpt-3.5-turbo",
             messages=[
                 {
-                    "role": "system", 
+                    "role": "system",
                     "content": "You are a language detection system. Respond with only the ISO 639-1 language code (2 letters) for the detected language. If unsure, respond with 'en'."
                 },
                 {
-                    "role": "user", 
-                    "content": f"Detect the language of this text: '{text}'"
+                    "role": "user",
+                    "content": f"Detect the language of this text: '{normalized}'"
                 }
             ],
             max_tokens=10,
             temperature=0
         )
         detected_lang = response.choices[0].message.content.strip().lower()
-        
-        # Validate that it's a supported language
-        if detected_lang in SUPPORTED_LANGUAGES:
-            return detected_lang
-        
+
+        # Default to English if detection returns an unsupported code
+        if detected_lang not in SUPPORTED_LANGUAGES:
+            detected_lang = 'en'
+
+        if len(_lang_api_cache) >= _LANG_API_CACHE_MAX:
+            _lang_api_cache.clear()
+        _lang_api_cache[normalized] = detected_lang
+        return detected_lang
     except Exception as e:
+        # Transient failures are not cached as detections
         logger.warning(f"Language detection failed: {e}")
-    
-    # Default to English if detection fails
-    return 'en'
+        return 'en'
 
 def get_language_specific_voice(language_code):
     """
@@ -176,92 +314,6 @@ def get_language_specific_voice(language_code):
     """
     return SUPPORTED_LANGUAGES.get(language_code, SUPPORTED_LANGUAGES['en'])['voice']
 
-def create_multilingual_system_prompt(language_code):
-    """
-    Create a system prompt in the appropriate language with restaurant knowledge
-    """
-    lang_info = SUPPORTED_LANGUAGES.get(language_code, SUPPORTED_LANGUAGES['en'])
-    lang_name = lang_info['name']
-    
-    # Base prompt with restaurant knowledge
-    if language_code == 'es':
-        system_prompt = f"""Eres un asistente de IA profesional para {RESTAURANT_INFO['name']}. Responde SIEMPRE en español de manera natural y amigable.
-
-INFORMACIÓN DEL RESTAURANTE:
-- Nombre: {RESTAURANT_INFO['name']}
-- Dirección: {RESTAURANT_INFO['address']}
-
-CONOCIMIENTO DEL MENÚ:
-Conoces todos los platos del menú incluyendo ingredientes, alérgenos, y preparación.
-
-INFORMACIÓN LOCAL:
-- Estacionamiento disponible en Main Street
-- Transporte público cerca
-- Atracciones cercanas en el centro
-
-REGLAS IMPORTANTES:
-1. Siempre responde en español
-2. Sé específico sobre ingredientes y alérgenos
-3. Ofrece alternativas si algo no está disponible
-4. Si necesitas consultar con el chef, di "Déjame consultar con el chef"
-5. Para reservas, pregunta: nombre, teléfono, número de personas, fecha, hora
-"""
-    elif language_code == 'fr':
-        system_prompt = f"""Vous êtes un assistant IA professionnel pour {RESTAURANT_INFO['name']}. Répondez TOUJOURS en français de manière naturelle et amicale.
-
-INFORMATIONS DU RESTAURANT:
-- Nom: {RESTAURANT_INFO['name']}
-- Adresse: {RESTAURANT_INFO['address']}
-
-CONNAISSANCE DU MENU:
-Vous connaissez tous les plats du menu, leurs ingrédients, allergènes et préparation.
-
-INFORMATIONS LOCALES:
-- Parking disponible sur Main Street
-- Transports publics à proximité
-- Attractions du centre-ville
-
-RÈGLES IMPORTANTES:
-1. Toujours répondre en français
-2. Être précis sur les ingrédients et allergènes
-3. Proposer des alternatives si nécessaire
-4. Si consultation chef nécessaire, dire "Laissez-moi consulter le chef"
-5. Pour réservations, demander: nom, téléphone, nombre de personnes, date, heure
-"""
-    else:
-        # Default English prompt with enhanced restaurant knowledge
-        system_prompt = f"""You are a professional AI assistant for {RESTAURANT_INFO['name']}. You have extensive knowledge about our restaurant and provide helpful, accurate information.
-
-RESTAURANT INFORMATION:
-- Name: {RESTAURANT_INFO['name']}
-- Address: {RESTAURANT_INFO['address']}
-
-DETAILED MENU KNOWLEDGE:
-You know every dish on our menu including ingredients, allergens, preparation methods, and possible modifications.
-
-LOCAL AREA EXPERTISE:
-- Parking available on Main Street (2-hour limit) and nearby lots
-- Public transportation accessible via metro and bus lines
-- Walking distance to downtown attractions and hotels
-
-IMPORTANT CONVERSATION RULES:
-1. Always respond in {lang_name}
-2. Be specific about ingredients and allergens when asked
-3. Offer alternatives if something isn't available
-4. If you need to check with kitchen staff, say "Let me check with the chef about that"
-5. For reservations, collect: name, phone, party size, date, time
-6. Be warm and welcoming, as if you're a knowledgeable staff member
-
-RESERVATION FLOW:
-- Ask for name and phone number first
-- Then ask for party size, date, and time
-- Confirm availability (use realistic responses)
-- Offer alternatives if requested time isn't available
-- Ask about special occasions or dietary needs
-"""
-    
-    return system_prompt
-
 # Database session helper
 def get_db():
     if not DATABASE_AVAILABLE or not SessionLocal:
@@ -274,8 +326,7 @@ def get_db():
         return None
 
 
-def get_twilio_client():
-    """Return a Twilio client if env vars and import are available, else None."""
+def _build_twilio_client():
     if not _twilio_import_ok:
         return None
     if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_PHONE_NUMBER):
@@ -285,9 +336,78 @@ def get_twilio_client():
     except Exception:
         return None
 
-# Configure OpenAI
+
+# One Twilio client per process: its pooled HTTP session is reused across
+# sends instead of renegotiating TLS per request
+_twilio_client = _build_twilio_client()
+
+
+def get_twilio_client():
+    """Return the shared Twilio client, or None if SMS is not configured."""
+    return _twilio_client
+
+# Configure OpenAI: one client per process so pooled HTTP/2 connections
+# (and their TLS handshakes) are reused across requests instead of being
+# renegotiated per call
+_OPENAI_LIMITS = httpx.Limits(max_keepalive_connections=50)
 if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+    openai_async_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(http2=True, limits=_OPENAI_LIMITS),
+    )
+else:
+    openai_async_client = None
+
+# Cap in-flight OpenAI requests so a traffic burst queues locally instead of
+# tripping the account RPM limit (whose penalty is far worse than a short
+# local wait). Size to roughly your tier's RPM / 60. The per-call timeout
+# keeps a hung upstream request from monopolizing a slot.
+_OPENAI_CONCURRENCY = int(os.environ.get("OPENAI_CONCURRENCY", "16"))
+_OPENAI_CALL_TIMEOUT = 8.0  # seconds
+_oai_sem = asyncio.Semaphore(_OPENAI_CONCURRENCY)
+
+# Retry transient upstream failures (429s, timeouts) with exponential backoff
+# plus jitter, so Twilio webhook retries don't amplify a vendor throttle into
+# cascading 500s.
+if _tenacity_import_ok:
+    _retry_upstream = tenacity.retry(
+        retry=tenacity.retry_if_exception_type((
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        )),
+        wait=tenacity.wait_exponential_jitter(initial=0.25, max=4),
+        stop=tenacity.stop_after_attempt(4),
+        reraise=True,
+    )
+else:
+    def _retry_upstream(func):
+        return func
+
+
+@_retry_upstream
+async def _chat_completion_async(**kwargs):
+    """Async chat completion with the same retry/backoff policy.
+
+    Keeps the event loop free during the network wait so concurrent calls
+    share one FastAPI worker instead of serializing behind a blocked thread.
+    """
+    async with _oai_sem:
+        return await asyncio.wait_for(
+            openai_async_client.chat.completions.create(**kwargs),
+            _OPENAI_CALL_TIMEOUT,
+        )
+
+
+@_retry_upstream
+async def _embedding_async(**kwargs):
+    """Async embedding call with retry/backoff."""
+    async with _oai_sem:
+        return await asyncio.wait_for(
+            openai_async_client.embeddings.create(**kwargs),
+            _OPENAI_CALL_TIMEOUT,
+        )
 
 # Configure ElevenLabs
 if ELEVENLABS_API_KEY:
@@ -324,6 +444,44 @@ LANGUAGE_PATTERNS = {
     'ar': ['مرحبا', 'شكرا', 'عذرا', 'حجز', 'طاولة']
 }
 
+# Pure-ASCII text cannot contain the non-Latin keywords (nor accented ones
+# like 'réservation'), so a reduced table covers the common case and skips
+# over half the scan work on English-dominated traffic
+_ASCII_LANG_PATTERNS = {
+    lang: [kw for kw in patterns if kw.isascii()]
+    for lang, patterns in LANGUAGE_PATTERNS.items()
+}
+_ASCII_LANG_PATTERNS = {lang: kws for lang, kws in _ASCII_LANG_PATTERNS.items() if kws}
+
+
+def _build_lang_automaton(table):
+    """Compile a keyword table into an Aho-Corasick automaton.
+
+    A keyword can belong to several languages ('mesa' is es and pt,
+    'restaurant' is fr and de), so each word carries the tuple of its
+    languages in table order; add_word would otherwise keep only the
+    last language registered.
+    """
+    keyword_langs = {}
+    for lang, patterns in table.items():
+        for keyword in patterns:
+            keyword_langs.setdefault(keyword, []).append(lang)
+    automaton = ahocorasick.Automaton()
+    for keyword, langs in keyword_langs.items():
+        automaton.add_word(keyword, tuple(langs))
+    automaton.make_automaton()
+    return automaton
+
+
+# Precompiled Aho-Corasick automata: one O(len(text)) pass finds every
+# language-tagged keyword instead of a substring scan per keyword. Two
+# variants so ASCII input scans only the ASCII keyword set.
+_LANG_AUTOMATON = None
+_LANG_AUTOMATON_ASCII = None
+if _ahocorasick_import_ok:
+    _LANG_AUTOMATON = _build_lang_automaton(LANGUAGE_PATTERNS)
+    _LANG_AUTOMATON_ASCII = _build_lang_automaton(_ASCII_LANG_PATTERNS)
+
 # Enhanced restaurant information for AI context
 RESTAURANT_INFO = {
     "name": "Bella Vista Italian Restaurant",
@@ -492,199 +650,743 @@ RESTAURANT_INFO = {
     """
 }
 
-# Mock reservation system (fallback)
-reservations = []
-call_history = {}
-call_languages = {}  # Store detected language for each call
-reservation_state = {}  # Track reservation progress per call
-
-# Security and spam protection
-call_rate_limit = defaultdict(list)  # Track calls per phone number
-blocked_numbers = set()  # Blocked phone numbers
-moderation_flags = defaultdict(int)  # Track inappropriate content per number
+# Static prompt pieces, interpolated once at import time so each call only
+# appends the per-conversation context. Keeping this block byte-identical
+# across turns also gives OpenAI's server-side prompt prefix caching a
+# stable prefix to hit.
+_HOURS_STR = "\n".join(f"- {day.title()}: {hours}" for day, hours in RESTAURANT_INFO['hours'].items())
 
-# Content moderation keywords
-INAPPROPRIATE_KEYWORDS = {
-    'profanity': ['fuck', 'shit', 'damn', 'bitch', 'asshole', 'bastard'],
-    'spam_indicators': ['test', 'testing', 'spam', 'fake', 'bot', 'automated'],
-    'malicious': ['hack', 'attack', 'virus', 'scam', 'fraud'],
-    'inappropriate_names': ['hitler', 'satan', 'devil', 'nazi']
-}
+RESTAURANT_CONTEXT_BLOCK = f"""
+Restaurant Information:
+- Name: {RESTAURANT_INFO['name']}
+- Address: {RESTAURANT_INFO['address']}
+- Phone: {RESTAURANT_INFO['phone']}
+- Website: {RESTAURANT_INFO['website']}
 
-# Rate limiting settings
-MAX_CALLS_PER_HOUR = 5
-MAX_MODERATION_FLAGS = 3
-RESERVATION_COOLDOWN = 300  # 5 minutes between reservations from same number
-last_analysis = {}
+Hours:
+{_HOURS_STR}
 
-def is_rate_limited(phone_number: str) -> bool:
-    """Check if phone number is rate limited"""
-    if phone_number in blocked_numbers:
-        return True
-    
-    current_time = time.time()
-    # Clean old calls (older than 1 hour)
-    call_rate_limit[phone_number] = [
-        call_time for call_time in call_rate_limit[phone_number] 
-        if current_time - call_time < 3600
-    ]
-    
-    # Check if exceeded rate limit
-    if len(call_rate_limit[phone_number]) >= MAX_CALLS_PER_HOUR:
-        logger.warning(f"Rate limit exceeded for {phone_number}")
-        return True
-    
-    # Add current call
-    call_rate_limit[phone_number].append(current_time)
-    return False
+Menu:
+{RESTAURANT_INFO['menu']}
 
-def moderate_content(text: str, phone_number: str) -> tuple[bool, str]:
-    """
-    Moderate content for inappropriate language and spam
-    Returns (is_safe, reason_if_blocked)
-    """
-    text_lower = text.lower()
-    
-    # Check for inappropriate keywords
-    for category, keywords in INAPPROPRIATE_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                moderation_flags[phone_number] += 1
-                logger.warning(f"Inappropriate content detected from {phone_number}: {category} - {keyword}")
-                
-                # Block after repeated violations
-                if moderation_flags[phone_number] >= MAX_MODERATION_FLAGS:
-                    blocked_numbers.add(phone_number)
-                    logger.error(f"Phone number {phone_number} blocked for repeated violations")
-                    return False, "account_blocked"
-                
-                return False, category
-    
-    # Check for repeated identical messages (spam detection)
-    if phone_number in call_history:
-        recent_messages = [
-            msg['content'] for msg in call_history[phone_number][-5:] 
-            if msg['role'] == 'user'
-        ]
-        if len(recent_messages) >= 3 and len(set(recent_messages)) <= 1:
-            moderation_flags[phone_number] += 1
-            logger.warning(f"Spam detected from {phone_number}: repeated messages")
-            return False, "spam_detected"
-    
-    return True, ""
+Special Features:
+{RESTAURANT_INFO['features']}
 
-def validate_reservation_data(data: dict, phone_number: str) -> tuple[bool, str]:
-    """
-    Validate reservation data for suspicious patterns
-    Returns (is_valid, reason_if_invalid)
-    """
-    # Check for inappropriate names
-    if 'name' in data:
-        name_lower = data['name'].lower()
-        for keyword in INAPPROPRIATE_KEYWORDS['inappropriate_names']:
-            if keyword in name_lower:
-                logger.warning(f"Inappropriate name detected: {data['name']}")
-                return False, "inappropriate_name"
-    
-    # Check reservation cooldown
-    current_time = time.time()
-    if phone_number in reservation_state:
-        last_reservation = reservation_state[phone_number].get('last_reservation_time', 0)
-        if current_time - last_reservation < RESERVATION_COOLDOWN:
-            logger.warning(f"Reservation cooldown active for {phone_number}")
-            return False, "too_frequent"
-    
-    return True, ""
+Your capabilities:
+1. Make reservations (collect details step by step: name & phone first, then party size, then date & time)
+2. Answer questions about hours, menu, location, special features
+3. Provide excellent service - be friendly and professional
+4. Handle reservation changes and cancellations
+5. Offer alternatives if requested time isn't available
+6. Ask for SMS consent before sending confirmations
+7. Escalate to human if customer requests or if you're unsure after 2 attempts
 
-def log_call_start(call_sid: str, from_number: str, to_number: str):
-    """Log call start to database"""
-    if not DATABASE_AVAILABLE:
-        return
-    
-    db = get_db()
-    if not db:
-        return
-    
-    try:
-        # Check if call already exists
-        existing_call = db.query(Call).filter(Call.call_sid == call_sid).first()
-        if not existing_call:
-            call = Call(
-                call_sid=call_sid,
-                from_number=from_number,
-                to_number=to_number,
-                status="in-progress"
-            )
-            db.add(call)
-            db.commit()
-            logger.info(f"Call {call_sid} logged to database")
-    except Exception as e:
-        logger.error(f"Failed to log call start: {e}")
-        db.rollback()
-    finally:
-        db.close()
+IMPORTANT CONVERSATION RULES:
+- Stay focused on the current task. Do NOT ask "Is there anything else I can help you with" unless the customer has completed their request.
+- For reservations, collect information step by step:
+  * First: Ask for name and phone number
+  * Second: Ask for party size
+  * Third: Ask for date and time
+  * Fourth: Ask for SMS consent for confirmation
+- Be formal and professional in tone
+- Only offer additional help when the current request is fully completed.
+- Be conversational and natural - don't sound robotic or repetitive.
 
-def log_transcript(call_sid: str, speaker: str, message: str, confidence: float = None):
-    """Log transcript to database"""
-    if not DATABASE_AVAILABLE:
-        return
-    
-    db = get_db()
-    if not db:
-        return
-    
-    try:
-        # Find the call
-        call = db.query(Call).filter(Call.call_sid == call_sid).first()
-        if call:
-            transcript = Transcript(
-                call_id=call.id,
-                speaker=speaker,
-                message=message,
-                confidence=confidence
-            )
-            db.add(transcript)
-            db.commit()
-            logger.info(f"Transcript logged for call {call_sid}")
-    except Exception as e:
-        logger.error(f"Failed to log transcript: {e}")
-        db.rollback()
-    finally:
-        db.close()
+RESERVATION FLOW EXAMPLES:
+- When someone says "I'd like to make a reservation": "I'd be happy to help you make a reservation. To get started, could you please provide your name and phone number?"
+- After getting name/phone: "Thank you. How many people will be in your party?"
+- After getting party size: "Perfect. What date and time would you prefer for your reservation?"
+- After getting date/time: "Excellent! Would you like me to send you a text message confirmation of your reservation?"
 
-def log_reservation(call_sid: str, reservation_data: dict):
-    """Log reservation to database"""
-    if not DATABASE_AVAILABLE:
-        return
-    
-    db = get_db()
-    if not db:
-        return
+SMS CONSENT:
+- Always ask for SMS consent after collecting all reservation details
+- If customer says yes: "Perfect! I'll send you a confirmation text. Your reservation is confirmed for [date] at [time] for [party_size] people. Thank you for choosing [restaurant_name]!"
+- If customer says no: "No problem! Your reservation is confirmed for [date] at [time] for [party_size] people. Thank you for choosing [restaurant_name]!"
+"""
+
+# Per-language system prompts, fully interpolated at import time so a turn
+# pays only a dict lookup. Spanish and French have hand-written prompts;
+# every other supported language uses the English-structured template with
+# its language name substituted in.
+_EN_PROMPT_TEMPLATE = """You are a professional AI assistant for {restaurant_name}. You have extensive knowledge about our restaurant and provide helpful, accurate information.
+
+RESTAURANT INFORMATION:
+- Name: {restaurant_name}
+- Address: {restaurant_address}
+
+DETAILED MENU KNOWLEDGE:
+You know every dish on our menu including ingredients, allergens, preparation methods, and possible modifications.
+
+LOCAL AREA EXPERTISE:
+- Parking available on Main Street (2-hour limit) and nearby lots
+- Public transportation accessible via metro and bus lines
+- Walking distance to downtown attractions and hotels
+
+IMPORTANT CONVERSATION RULES:
+1. Always respond in {lang_name}
+2. Be specific about ingredients and allergens when asked
+3. Offer alternatives if something isn't available
+4. If you need to check with kitchen staff, say "Let me check with the chef about that"
+5. For reservations, collect: name, phone, party size, date, time
+6. Be warm and welcoming, as if you're a knowledgeable staff member
+
+RESERVATION FLOW:
+- Ask for name and phone number first
+- Then ask for party size, date, and time
+- Confirm availability (use realistic responses)
+- Offer alternatives if requested time isn't available
+- Ask about special occasions or dietary needs
+"""
+
+PROMPT_TEMPLATES = {
+    code: _EN_PROMPT_TEMPLATE.format(
+        restaurant_name=RESTAURANT_INFO['name'],
+        restaurant_address=RESTAURANT_INFO['address'],
+        lang_name=info['name'],
+    )
+    for code, info in SUPPORTED_LANGUAGES.items()
+}
+
+PROMPT_TEMPLATES['es'] = f"""Eres un asistente de IA profesional para {RESTAURANT_INFO['name']}. Responde SIEMPRE en español de manera natural y amigable.
+
+INFORMACIÓN DEL RESTAURANTE:
+- Nombre: {RESTAURANT_INFO['name']}
+- Dirección: {RESTAURANT_INFO['address']}
+
+CONOCIMIENTO DEL MENÚ:
+Conoces todos los platos del menú incluyendo ingredientes, alérgenos, y preparación.
+
+INFORMACIÓN LOCAL:
+- Estacionamiento disponible en Main Street
+- Transporte público cerca
+- Atracciones cercanas en el centro
+
+REGLAS IMPORTANTES:
+1. Siempre responde en español
+2. Sé específico sobre ingredientes y alérgenos
+3. Ofrece alternativas si algo no está disponible
+4. Si necesitas consultar con el chef, di "Déjame consultar con el chef"
+5. Para reservas, pregunta: nombre, teléfono, número de personas, fecha, hora
+"""
+
+PROMPT_TEMPLATES['fr'] = f"""Vous êtes un assistant IA professionnel pour {RESTAURANT_INFO['name']}. Répondez TOUJOURS en français de manière naturelle et amicale.
+
+INFORMATIONS DU RESTAURANT:
+- Nom: {RESTAURANT_INFO['name']}
+- Adresse: {RESTAURANT_INFO['address']}
+
+CONNAISSANCE DU MENU:
+Vous connaissez tous les plats du menu, leurs ingrédients, allergènes et préparation.
+
+INFORMATIONS LOCALES:
+- Parking disponible sur Main Street
+- Transports publics à proximité
+- Attractions du centre-ville
+
+RÈGLES IMPORTANTES:
+1. Toujours répondre en français
+2. Être précis sur les ingrédients et allergènes
+3. Proposer des alternatives si nécessaire
+4. Si consultation chef nécessaire, dire "Laissez-moi consulter le chef"
+5. Pour réservations, demander: nom, téléphone, nombre de personnes, date, heure
+"""
+
+# Appended to the system prompt so one completion yields both the spoken
+# reply and the structured per-turn analysis
+ANALYSIS_OUTPUT_INSTRUCTIONS = """
+
+OUTPUT FORMAT:
+Return a single JSON object with exactly these keys:
+- "reply": your next utterance to the caller, natural and concise
+- "reservation_complete": boolean, true only when name, phone, party size, date and time have all been collected
+- "sms_consent": "yes", "no" or "unknown"
+- "details": object with keys name, phone, party_size, date, time (null when unknown)
+"""
+
+_PROMPT_SUFFIX = """
+
+Respond naturally and conversationally. Keep responses concise but helpful."""
+
+# The complete system prompt per language, assembled once at import. The
+# bytes are identical across turns and callers — no per-call state is
+# interpolated — so OpenAI's server-side prefix caching can skip the
+# prefill for the whole block.
+FULL_SYSTEM_PROMPTS = {
+    code: template + RESTAURANT_CONTEXT_BLOCK + ANALYSIS_OUTPUT_INSTRUCTIONS + _PROMPT_SUFFIX
+    for code, template in PROMPT_TEMPLATES.items()
+}
+
+# Mock reservation system (fallback)
+reservations = []
+# Per-call and per-caller state is TTL-bounded: abandoned calls whose status
+# callback never fires would otherwise accumulate forever in a long-running
+# process. Plain dicts remain the unbounded fallback without cachetools.
+if TTLCache is not None:
+    call_history = TTLCache(maxsize=50_000, ttl=3600)
+    call_languages = TTLCache(maxsize=50_000, ttl=3600)
+    reservation_state = TTLCache(maxsize=100_000, ttl=24 * 3600)
+    last_analysis = TTLCache(maxsize=50_000, ttl=3600)
+else:
+    call_history = {}
+    call_languages = {}  # Store detected language for each call
+    reservation_state = {}  # Track reservation progress per call
+    last_analysis = {}
+
+# Security and spam protection
+call_rate_limit = defaultdict(deque)  # Monotonic call timestamps per phone number
+
+# Rolling window of recent user-message hashes per phone number; the paired
+# Counter makes the repeated-message spam test O(1) per utterance. TTL-bounded
+# like the other per-caller state so it cannot grow one entry per unique
+# caller forever.
+if TTLCache is not None:
+    _recent_msgs = TTLCache(maxsize=100_000, ttl=3600)
+else:
+    _recent_msgs = {}
+# Security state is TTL-bounded so a long-running process does not keep
+# every caller number forever: flags expire after a day and blocks after a
+# week (auto-unblocking repeat offenders). Plain dicts are the unbounded
+# fallback when cachetools is absent.
+if TTLCache is not None:
+    blocked_numbers = TTLCache(maxsize=10_000, ttl=7 * 24 * 3600)
+    moderation_flags = TTLCache(maxsize=100_000, ttl=24 * 3600)
+else:
+    blocked_numbers = {}
+    moderation_flags = {}
+
+# Content moderation keywords. Frozensets give C-level hash membership:
+# the message is tokenized once and each category check is a set
+# intersection, which keeps word boundaries implicit (no "assassin"
+# matching "ass") without a regex scan per category.
+INAPPROPRIATE_KEYWORDS = {
+    'profanity': frozenset(['fuck', 'shit', 'damn', 'bitch', 'asshole', 'bastard']),
+    'spam_indicators': frozenset(['test', 'testing', 'spam', 'fake', 'bot', 'automated']),
+    'malicious': frozenset(['hack', 'attack', 'virus', 'scam', 'fraud']),
+    'inappropriate_names': frozenset(['hitler', 'satan', 'devil', 'nazi'])
+}
+
+# Flattened view for the hot path: one intersection against the union of all
+# categories, then a dict hop to recover which category fired
+_ALL_INAPPROPRIATE = frozenset().union(*INAPPROPRIATE_KEYWORDS.values())
+_KEYWORD_CATEGORY = {
+    keyword: category
+    for category, keywords in INAPPROPRIATE_KEYWORDS.items()
+    for keyword in keywords
+}
+
+_TOKEN_RE = re.compile(r"[a-z']+")
+
+
+@lru_cache(maxsize=1024)
+def _tokenize(text_lower: str) -> frozenset:
+    """Token set for a lowercased utterance.
+
+    Memoized because short confirmations ("yes", "no", "three people")
+    repeat constantly across calls; tokenizing is side-effect-free, so
+    unlike the full moderation verdict it is safe to cache.
+    """
+    return frozenset(_TOKEN_RE.findall(text_lower))
+
+# Rate limiting settings
+MAX_CALLS_PER_HOUR = 5
+MAX_MODERATION_FLAGS = 3
+RESERVATION_COOLDOWN = 300  # 5 minutes between reservations from same number
+
+# Redis-backed call state (enables scaling past one uvicorn worker and bounds
+# memory via TTLs; the in-process dicts remain the local-dev fallback)
+USE_REDIS = os.environ.get("USE_REDIS", "").lower() in ("1", "true", "yes")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+CALL_HISTORY_TTL = 3600  # seconds; outlives the longest call we expect
+MAX_HISTORY_MESSAGES = 20
+
+# Connection setup is deferred to startup (the async client cannot ping
+# without a running loop); a failed ping downgrades to in-memory state.
+# Every Redis round-trip below is try/except-guarded the same way the DB
+# writes are: a Redis hiccup degrades to the in-process fallback instead
+# of turning webhooks into 500s that Twilio retries.
+redis_client = None
+if USE_REDIS and _redis_import_ok:
+    redis_client = redis_async.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+async def _history_append(call_sid: str, message: dict):
+    """Append a message to the call's conversation history"""
+    if redis_client is not None:
+        try:
+            key = f"call:{call_sid}"
+            pipe = redis_client.pipeline()
+            pipe.rpush(key, _json_dumps(message))
+            pipe.expire(key, CALL_HISTORY_TTL)
+            await pipe.execute()
+            return
+        except Exception as e:
+            logger.warning(f"Redis history append failed, using in-memory state: {e}")
+    # Bounded deque: appends evict the oldest turn in place, so there is
+    # no per-turn slice/reallocation to trim the history
+    call_history.setdefault(call_sid, deque(maxlen=MAX_HISTORY_MESSAGES)).append(message)
+
+
+async def _history_get(call_sid: str) -> list:
+    """Return the trimmed conversation history for a call"""
+    if redis_client is not None:
+        try:
+            raw = await redis_client.lrange(f"call:{call_sid}", -MAX_HISTORY_MESSAGES, -1)
+            return [_json_loads(item) for item in raw]
+        except Exception as e:
+            logger.warning(f"Redis history read failed, using in-memory state: {e}")
+    return list(call_history.get(call_sid, ()))
+
+
+async def _history_clear(call_sid: str):
+    """Drop a call's conversation state once Twilio reports it finished.
+
+    The Redis keys would expire anyway via TTL; deleting eagerly keeps the
+    in-process dicts from holding every finished call until then.
+    """
+    if redis_client is not None:
+        try:
+            await redis_client.delete(f"call:{call_sid}")
+        except Exception as e:
+            logger.warning(f"Redis history delete failed: {e}")
+    call_history.pop(call_sid, None)
+    call_languages.pop(call_sid, None)
+    last_analysis.pop(call_sid, None)
+
+
+async def _reservation_cooldown_active(phone_number: str) -> bool:
+    """Check whether the caller reserved within the cooldown window"""
+    if redis_client is not None:
+        try:
+            return await redis_client.exists(f"res_cooldown:{phone_number}") > 0
+        except Exception as e:
+            logger.warning(f"Redis cooldown read failed, using in-memory state: {e}")
+    last_reservation = reservation_state.get(phone_number, {}).get('last_reservation_time', 0)
+    return time.time() - last_reservation < RESERVATION_COOLDOWN
+
+
+async def _mark_reservation(phone_number: str):
+    """Start the reservation cooldown window for a caller"""
+    if redis_client is not None:
+        try:
+            await redis_client.set(f"res_cooldown:{phone_number}", "1", ex=RESERVATION_COOLDOWN)
+            return
+        except Exception as e:
+            logger.warning(f"Redis cooldown write failed, using in-memory state: {e}")
+    reservation_state.setdefault(phone_number, {})['last_reservation_time'] = time.time()
+
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL = 3600  # seconds
+SEMANTIC_CACHE_MAX_ENTRIES = 4096
+
+# Compact language ids for the cache's vectorized language mask
+_SEMANTIC_CACHE_LANG_IDS = {code: i for i, code in enumerate(SUPPORTED_LANGUAGES)}
+
+
+class SemanticCache:
+    """In-process semantic cache over FAQ-style assistant replies.
+
+    Hours/menu/location questions dominate restaurant calls but arrive as
+    paraphrases an exact-string cache would miss. Entries are keyed by the
+    embedding of the user utterance; a lookup whose cosine similarity clears
+    the threshold returns the cached reply and skips the GPT round-trip.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: int = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.ttl = ttl
+        # Normalized embeddings live in one preallocated float32 matrix so a
+        # lookup is a single BLAS matvec instead of a Python loop of dots.
+        # Timestamps and language ids sit in parallel arrays so the TTL and
+        # language masks are vectorized too; replies holds the reply strings.
+        self.n = 0
+        self._matrix = None
+        self._timestamps = None
+        self._lang_ids = None
+        self.replies = []
+
+    def _ensure_capacity(self, dim: int):
+        """Grow the embedding matrix by doubling when it fills up"""
+        if self._matrix is None:
+            self._matrix = np.empty((256, dim), dtype=np.float32)
+            self._timestamps = np.empty(256, dtype=np.float64)
+            self._lang_ids = np.empty(256, dtype=np.int16)
+        elif self.n >= self._matrix.shape[0]:
+            cap = self._matrix.shape[0] * 2
+            grown = np.empty((cap, dim), dtype=np.float32)
+            grown[:self.n] = self._matrix[:self.n]
+            self._matrix = grown
+            self._timestamps = np.resize(self._timestamps, cap)
+            self._lang_ids = np.resize(self._lang_ids, cap)
+
+    async def _embed(self, text: str):
+        """Return the normalized embedding for a text, or None on failure"""
+        try:
+            response = await _embedding_async(model="text-embedding-3-small", input=text)
+            vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(vector))
+            return vector / norm if norm else vector
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+
+    async def lookup(self, text: str, lang: str):
+        """Return (cached reply or None, query embedding or None).
+
+        The embedding is handed back so a miss can be stored later without
+        re-embedding the utterance.
+        """
+        if np is None or not OPENAI_API_KEY:
+            return None, None
+        query = await self._embed(text)
+        if query is None:
+            return None, None
+        if self.n == 0:
+            return None, query
+
+        # One SGEMV over all cached embeddings, then mask out entries in the
+        # wrong language or past their TTL — all array ops, no Python loop
+        sims = self._matrix[:self.n] @ query
+        valid = (self._lang_ids[:self.n] == _SEMANTIC_CACHE_LANG_IDS.get(lang, -1))
+        valid &= (time.time() - self._timestamps[:self.n]) <= self.ttl
+        if not valid.any():
+            return None, query
+        sims[~valid] = -1.0
+        best = int(sims.argmax())
+
+        if sims[best] >= self.threshold:
+            return self.replies[best], query
+        return None, query
+
+    def store(self, embedding, reply: str, lang: str):
+        """Insert a reply under a previously computed query embedding"""
+        if embedding is None:
+            return
+        if self.n >= SEMANTIC_CACHE_MAX_ENTRIES:
+            # Evict the oldest entry: shift rows down one slot
+            self._matrix[:self.n - 1] = self._matrix[1:self.n]
+            self._timestamps[:self.n - 1] = self._timestamps[1:self.n]
+            self._lang_ids[:self.n - 1] = self._lang_ids[1:self.n]
+            self.replies.pop(0)
+            self.n -= 1
+        self._ensure_capacity(embedding.shape[0])
+        np.copyto(self._matrix[self.n], embedding)
+        self._timestamps[self.n] = time.time()
+        self._lang_ids[self.n] = _SEMANTIC_CACHE_LANG_IDS.get(lang, -1)
+        self.replies.append(reply)
+        self.n += 1
+
+
+semantic_cache = SemanticCache()
+
+# In-process fallback for idempotency claims: key -> expiry timestamp
+_idempotency_local: Dict[str, float] = {}
+
+
+async def _idempotency_claim(key: str, ttl: int = 600) -> bool:
+    """Claim an idempotency key; False means the work already happened.
+
+    Twilio retries webhooks on 5xx, so side effects (reservation writes, SMS
+    sends) are guarded by a short-lived claim keyed on CallSid + step.
+    """
+    if redis_client is not None:
+        try:
+            return bool(await redis_client.set(f"idem:{key}", "1", nx=True, ex=ttl))
+        except Exception as e:
+            logger.warning(f"Redis idempotency claim failed, using in-memory state: {e}")
+    now = time.time()
+    expiry = _idempotency_local.get(key)
+    if expiry is not None and expiry > now:
+        return False
+    # Opportunistically drop expired claims to bound memory
+    if len(_idempotency_local) > 10000:
+        for k, exp in list(_idempotency_local.items()):
+            if exp <= now:
+                del _idempotency_local[k]
+    _idempotency_local[key] = now + ttl
+    return True
+
+# Security state lives in Redis when available so it is O(1) per check,
+# survives restarts, and is shared across workers (a caller could otherwise
+# bypass the limit by landing on a different worker). Block lookups sit on
+# the hot /voice/ path, so they go through a short-lived local cache.
+_BLOCKED_SET_KEY = "blocked_numbers"
+_BLOCKED_CACHE_TTL = 5.0  # seconds
+_BLOCKED_CACHE_MAX = 10_000
+_blocked_local: Dict[str, tuple] = {}  # phone -> (is_blocked, cached_until)
+
+
+async def _is_blocked(phone_number: str) -> bool:
+    """Blocked-set membership, read through a 5s local cache when on Redis."""
+    if redis_client is not None:
+        now = time.monotonic()
+        cached = _blocked_local.get(phone_number)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        try:
+            hit = bool(await redis_client.sismember(_BLOCKED_SET_KEY, phone_number))
+        except Exception as e:
+            logger.warning(f"Redis blocked-set read failed, using in-memory state: {e}")
+            return phone_number in blocked_numbers
+        # Opportunistically drop expired entries to bound memory, the same
+        # idiom as _idempotency_local (the 5s TTL expires almost all of them)
+        if len(_blocked_local) > _BLOCKED_CACHE_MAX:
+            for cached_phone, (_, cached_until) in list(_blocked_local.items()):
+                if cached_until <= now:
+                    del _blocked_local[cached_phone]
+        _blocked_local[phone_number] = (hit, now + _BLOCKED_CACHE_TTL)
+        return hit
+    return phone_number in blocked_numbers
+
+
+async def _block_number(phone_number: str):
+    if redis_client is not None:
+        try:
+            await redis_client.sadd(_BLOCKED_SET_KEY, phone_number)
+            _blocked_local[phone_number] = (True, time.monotonic() + _BLOCKED_CACHE_TTL)
+            return
+        except Exception as e:
+            logger.warning(f"Redis blocked-set write failed, using in-memory state: {e}")
+    blocked_numbers[phone_number] = True
+
+
+async def _bump_moderation_flags(phone_number: str) -> int:
+    """Increment and return the caller's moderation flag count."""
+    if redis_client is not None:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.incr(f"mod_flags:{phone_number}")
+            pipe.expire(f"mod_flags:{phone_number}", 24 * 3600)
+            flags, _ = await pipe.execute()
+            return int(flags)
+        except Exception as e:
+            logger.warning(f"Redis moderation counter failed, using in-memory state: {e}")
+    flags = moderation_flags.get(phone_number, 0) + 1
+    moderation_flags[phone_number] = flags
+    return flags
+
+
+async def is_rate_limited(phone_number: str) -> bool:
+    """Check if phone number is rate limited"""
+    if await _is_blocked(phone_number):
+        return True
+
+    if redis_client is not None:
+        # Fixed hourly window: one INCR per call, expiry slightly past the
+        # hour so stale counters clean themselves up
+        try:
+            key = f"rl:{phone_number}:{int(time.time() // 3600)}"
+            pipe = redis_client.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, 3700)
+            count, _ = await pipe.execute()
+            if int(count) > MAX_CALLS_PER_HOUR:
+                logger.warning(f"Rate limit exceeded for {phone_number}")
+                return True
+            return False
+        except Exception as e:
+            logger.warning(f"Redis rate-limit check failed, using in-memory state: {e}")
+
+    current_time = time.monotonic()
+    window = call_rate_limit[phone_number]
+    # Evict entries older than 1 hour from the left; amortized O(1) versus
+    # rebuilding the whole list on every call
+    while window and current_time - window[0] >= 3600:
+        window.popleft()
+
+    # Check if exceeded rate limit
+    if len(window) >= MAX_CALLS_PER_HOUR:
+        logger.warning(f"Rate limit exceeded for {phone_number}")
+        return True
+
+    # Add current call
+    window.append(current_time)
+    return False
+
+async def moderate_content(text: str, phone_number: str, text_lower: Optional[str] = None) -> tuple[bool, str]:
+    """
+    Moderate content for inappropriate language and spam
+    Returns (is_safe, reason_if_blocked)
+
+    Accepts a pre-lowercased copy so the caller pays for str.lower() once
+    per turn rather than once per consumer.
+    """
+    if text_lower is None:
+        text_lower = text.lower()
+    tokens = _tokenize(text_lower)
+
+    # Check for inappropriate keywords: one tokenize pass and one
+    # intersection against every category at once
+    hit = tokens & _ALL_INAPPROPRIATE
+    if hit:
+        word = next(iter(hit))
+        category = _KEYWORD_CATEGORY[word]
+        flags = await _bump_moderation_flags(phone_number)
+        logger.warning(f"Inappropriate content detected from {phone_number}: {category} - {word}")
+
+        # Block after repeated violations
+        if flags >= MAX_MODERATION_FLAGS:
+            await _block_number(phone_number)
+            logger.error(f"Phone number {phone_number} blocked for repeated violations")
+            return False, "account_blocked"
+
+        return False, category
+
+
+    # Check for repeated identical messages (spam detection). The rolling
+    # hash window is tracked per phone number; call_history is keyed by
+    # call_sid so it cannot serve as a per-caller record here.
+    entry = _recent_msgs.get(phone_number)
+    if entry is None:
+        entry = (deque(maxlen=5), Counter())
+        _recent_msgs[phone_number] = entry
+    window, counts = entry
+    msg_hash = hash(text_lower)
+    if len(window) == window.maxlen:
+        evicted = window[0]
+        counts[evicted] -= 1
+        if counts[evicted] <= 0:
+            del counts[evicted]
+    window.append(msg_hash)
+    counts[msg_hash] += 1
+    # Spam means the window holds nothing but one repeated message (the
+    # baseline semantics); merely saying "yes" at three prompts in five
+    # turns is the normal reservation flow and must not trip this
+    if len(window) >= 3 and counts[msg_hash] == len(window):
+        await _bump_moderation_flags(phone_number)
+        logger.warning(f"Spam detected from {phone_number}: repeated messages")
+        return False, "spam_detected"
+
+    return True, ""
+
+async def validate_reservation_data(data: dict, phone_number: str) -> tuple[bool, str]:
+    """
+    Validate reservation data for suspicious patterns
+    Returns (is_valid, reason_if_invalid)
+    """
+    # Check for inappropriate names
+    if 'name' in data:
+        name_tokens = _tokenize(data['name'].lower())
+        if name_tokens & INAPPROPRIATE_KEYWORDS['inappropriate_names']:
+            logger.warning(f"Inappropriate name detected: {data['name']}")
+            return False, "inappropriate_name"
     
+    # Check reservation cooldown
+    if await _reservation_cooldown_active(phone_number):
+        logger.warning(f"Reservation cooldown active for {phone_number}")
+        return False, "too_frequent"
+
+    return True, ""
+
+# Background database writer. Transcript/reservation/call-end logging sits on
+# the voice hot path, so instead of paying a DB round-trip per utterance the
+# log_* helpers enqueue work items and a daemon thread flushes them in batches.
+_DB_BATCH_MAX = 64
+_DB_BATCH_WAIT = 0.05  # seconds to wait for more items once a batch has started
+
+# Bounded so a stalled database cannot balloon process memory; when the
+# queue is full the write is dropped and counted rather than blocking the
+# voice path
+_db_queue: queue.Queue = queue.Queue(maxsize=10_000)
+_db_dropped_writes = 0
+
+
+def _db_enqueue(item) -> None:
+    """Queue a write for the background flusher, dropping if it is full"""
+    global _db_dropped_writes
     try:
-        # Find the call
+        _db_queue.put_nowait(item)
+    except queue.Full:
+        _db_dropped_writes += 1
+        logger.warning(f"Database write queue full; dropped {item[0]} write ({_db_dropped_writes} total)")
+
+# call_sid -> Call.id cache so each queued transcript/reservation write does
+# not repeat the same SELECT; filled by log_call_start, dropped on call end
+call_id_by_sid: Dict[str, int] = {}
+
+
+def _drain_db_queue():
+    """Block for one work item, then collect more for up to _DB_BATCH_WAIT."""
+    items = [_db_queue.get()]
+    deadline = time.monotonic() + _DB_BATCH_WAIT
+    while len(items) < _DB_BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(_db_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+
+def _resolve_call_id(db, call_sid: str):
+    """Return Call.id for a call_sid, preferring the process-local cache"""
+    call_id = call_id_by_sid.get(call_sid)
+    if call_id is not None:
+        return call_id
+    call = db.query(Call).filter(Call.call_sid == call_sid).first()
+    if call:
+        call_id_by_sid[call_sid] = call.id
+        return call.id
+    return None
+
+
+def _apply_db_item(db, kind: str, call_sid: str, payload):
+    """Translate one queued work item into ORM operations on the session"""
+    if kind == "call_end":
         call = db.query(Call).filter(Call.call_sid == call_sid).first()
         if call:
-            reservation = Reservation(
-                call_id=call.id,
-                customer_name=reservation_data.get('name'),
-                customer_phone=reservation_data.get('phone'),
-                party_size=reservation_data.get('party_size'),
-                reservation_time=reservation_data.get('time'),
-                status="confirmed",
-                sms_consent=reservation_data.get('sms_consent', False)
-            )
-            db.add(reservation)
+            call.status = "completed"
+            call.end_time = func.now()
+        call_id_by_sid.pop(call_sid, None)
+        return
+    call_id = _resolve_call_id(db, call_sid)
+    if call_id is None:
+        return
+    if kind == "transcript":
+        db.add(Transcript(
+            call_id=call_id,
+            speaker=payload['speaker'],
+            message=payload['message'],
+            confidence=payload['confidence']
+        ))
+    elif kind == "reservation":
+        db.add(Reservation(
+            call_id=call_id,
+            customer_name=payload.get('name'),
+            customer_phone=payload.get('phone'),
+            party_size=payload.get('party_size'),
+            reservation_time=payload.get('time'),
+            status="confirmed",
+            sms_consent=payload.get('sms_consent', False)
+        ))
+
+
+def _db_writer_loop():
+    """Drain queued log writes and commit each batch in a single transaction"""
+    while True:
+        items = _drain_db_queue()
+        db = get_db()
+        if not db:
+            continue
+        try:
+            for kind, call_sid, payload in items:
+                _apply_db_item(db, kind, call_sid, payload)
             db.commit()
-            logger.info(f"Reservation logged for call {call_sid}")
-    except Exception as e:
-        logger.error(f"Failed to log reservation: {e}")
-        db.rollback()
-    finally:
-        db.close()
+            logger.debug(f"Flushed {len(items)} queued database writes")
+        except Exception as e:
+            logger.error(f"Background database write failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
 
-def log_call_end(call_sid: str):
-    """Log call end to database"""
+
+if DATABASE_AVAILABLE:
+    threading.Thread(target=_db_writer_loop, name="db-writer", daemon=True).start()
+
+def log_call_start(call_sid: str, from_number: str, to_number: str):
+    """Log call start to database (synchronous: later writes need the Call row)"""
     if not DATABASE_AVAILABLE:
         return
     
@@ -693,215 +1395,445 @@ def log_call_end(call_sid: str):
         return
     
     try:
-        call = db.query(Call).filter(Call.call_sid == call_sid).first()
-        if call:
-            call.status = "completed"
-            call.end_time = func.now()
+        # Check if call already exists
+        existing_call = db.query(Call).filter(Call.call_sid == call_sid).first()
+        if not existing_call:
+            call = Call(
+                call_sid=call_sid,
+                from_number=from_number,
+                to_number=to_number,
+                status="in-progress"
+            )
+            db.add(call)
             db.commit()
-            logger.info(f"Call {call_sid} marked as completed")
+            call_id_by_sid[call_sid] = call.id
+            logger.info(f"Call {call_sid} logged to database")
+        else:
+            call_id_by_sid[call_sid] = existing_call.id
     except Exception as e:
-        logger.error(f"Failed to log call end: {e}")
+        logger.error(f"Failed to log call start: {e}")
         db.rollback()
     finally:
         db.close()
 
-def transcribe_audio(audio_url: str) -> str:
-    """Transcribe audio using OpenAI Whisper"""
+def log_transcript(call_sid: str, speaker: str, message: str, confidence: float = None):
+    """Queue a transcript write for the background database writer"""
+    if not DATABASE_AVAILABLE:
+        return
+    _db_enqueue(("transcript", call_sid, {
+        'speaker': speaker,
+        'message': message,
+        'confidence': confidence
+    }))
+
+def log_reservation(call_sid: str, reservation_data: dict):
+    """Queue a reservation write for the background database writer"""
+    if not DATABASE_AVAILABLE:
+        return
+    _db_enqueue(("reservation", call_sid, reservation_data))
+
+def log_call_end(call_sid: str):
+    """Queue the call-completed update for the background database writer"""
+    if not DATABASE_AVAILABLE:
+        return
+    _db_enqueue(("call_end", call_sid, None))
+
+async def transcribe_audio(audio_url: str) -> str:
+    """Transcribe audio using OpenAI Whisper.
+
+    The recording is streamed down in 16 KB chunks rather than loaded in one
+    read, so the transfer overlaps with the response instead of buffering the
+    whole file before anything happens.
+    """
     try:
         if not OPENAI_API_KEY:
             return "I'm sorry, I'm experiencing technical difficulties. Please call back later."
-        
-        # For now, return a mock transcription
-        # In production, you would use: openai.Audio.transcribe("whisper-1", audio_file)
-        return "I would like to make a reservation"
+
+        buf = io.BytesIO()
+        async with httpx.AsyncClient() as http:
+            async with http.stream("GET", audio_url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(16384):
+                    buf.write(chunk)
+        buf.name = "recording.wav"  # the SDK infers the format from the name
+        buf.seek(0)
+
+        transcription = await openai_async_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=buf,
+            response_format="text",
+        )
+        return transcription.strip()
     except Exception as e:
         logger.error(f"Error transcribing audio: {e}")
         return "I'm sorry, I couldn't understand that. Could you please repeat?"
 
-def generate_ai_response(user_message: str, call_sid: str) -> str:
-    """Generate multilingual AI response using OpenAI GPT with language detection"""
+# Strict schema for the fused reply+analysis completion: the server
+# guarantees conforming JSON, so no repair parsing is needed
+_TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reply": {"type": "string"},
+        "reservation_complete": {"type": "boolean"},
+        "sms_consent": {"enum": ["yes", "no", "unknown"]},
+        "details": {
+            "type": "object",
+            "properties": {
+                "name": {"type": ["string", "null"]},
+                "phone": {"type": ["string", "null"]},
+                "party_size": {"type": ["integer", "null"]},
+                "date": {"type": ["string", "null"]},
+                "time": {"type": ["string", "null"]},
+            },
+            "required": ["name", "phone", "party_size", "date", "time"],
+            "additionalProperties": False,
+        },
+    },
+    "required": ["reply", "reservation_complete", "sms_consent", "details"],
+    "additionalProperties": False,
+}
+
+_TURN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "turn", "schema": _TURN_SCHEMA, "strict": True},
+}
+
+
+def _default_analysis() -> dict:
+    return {"reservation_complete": False, "sms_consent": "unknown", "details": {}}
+
+
+async def generate_ai_response(user_message: str, call_sid: str, text_lower: Optional[str] = None) -> tuple:
+    """Generate the reply and the per-turn analysis in a single OpenAI call.
+
+    One JSON-mode completion returns both the assistant utterance and the
+    reservation/consent analysis, so each turn pays one network round-trip
+    and one system-prompt prefill instead of two. Returns
+    (ai_response, analysis_dict).
+    """
+    analysis = _default_analysis()
     try:
         if not OPENAI_API_KEY:
-            return "I'm sorry, I'm experiencing technical difficulties. Please call back later."
-        
+            return "I'm sorry, I'm experiencing technical difficulties. Please call back later.", analysis
+
         # Detect language from user input
-        detected_language = detect_language(user_message)
+        detected_language = await detect_language(user_message, text_lower)
         logger.info(f"Detected language: {detected_language} for message: {user_message}")
-        
+
         # Store language preference for this call
         if call_sid not in call_languages:
             call_languages[call_sid] = detected_language
-        
-        # Get conversation history
-        history = call_history.get(call_sid, [])
-        
-        # Add user message to history
-        history.append({"role": "user", "content": user_message})
-        
-        # Keep only last 10 messages to avoid token limits
-        if len(history) > 10:
-            history = history[-10:]
-        
-        # Create language-specific system prompt
-        system_prompt = create_multilingual_system_prompt(detected_language)
 
-Restaurant Information:
-- Name: {RESTAURANT_INFO['name']}
-- Address: {RESTAURANT_INFO['address']}
-- Phone: {RESTAURANT_INFO['phone']}
-- Website: {RESTAURANT_INFO['website']}
+        # Record the user message and fetch the trimmed conversation history
+        # (Redis-backed when USE_REDIS is set, in-memory otherwise)
+        await _history_append(call_sid, {"role": "user", "content": user_message})
+        history = await _history_get(call_sid)
+
+        # Stateless FAQ turns (no prior conversation) are served from the
+        # semantic cache when a near-duplicate utterance was answered recently
+        cache_embedding = None
+        if len(history) <= 1:
+            cached_reply, cache_embedding = await semantic_cache.lookup(user_message, detected_language)
+            if cached_reply is not None:
+                await _history_append(call_sid, {"role": "assistant", "content": cached_reply})
+                return cached_reply, analysis
+
+        # The system prompt is a fully static per-language constant; the
+        # volatile turn counter was dropped deliberately (the model already
+        # sees the history) so the prompt prefix stays cache-friendly
+        system_prompt = FULL_SYSTEM_PROMPTS.get(detected_language, FULL_SYSTEM_PROMPTS['en'])
 
-Hours:
-{chr(10).join([f"- {day.title()}: {hours}" for day, hours in RESTAURANT_INFO['hours'].items()])}
+        # Prepare messages for OpenAI
+        messages = [{"role": "system", "content": system_prompt}] + history
 
-Menu:
-{RESTAURANT_INFO['menu']}
+        # One fused call; the strict schema guarantees a conforming object
+        response = await _chat_completion_async(
+            model="gpt-4o-mini",
+            messages=messages,
+            max_tokens=300,
+            temperature=0.7,
+            response_format=_TURN_RESPONSE_FORMAT,
+        )
 
-Special Features:
-{RESTAURANT_INFO['features']}
+        raw = response.choices[0].message.content
+        try:
+            parsed = _json_loads(raw)
+            ai_response = str(parsed.get("reply") or "").strip()
+            if not ai_response:
+                raise ValueError("empty reply")
+            analysis = {
+                "reservation_complete": bool(parsed.get("reservation_complete", False)),
+                "sms_consent": parsed.get("sms_consent", "unknown"),
+                "details": parsed.get("details") or {},
+            }
+        except (ValueError, TypeError) as exc:  # JSONDecodeError subclasses ValueError
+            # The content is schema-constrained JSON (a parse failure is
+            # realistically truncation at max_tokens), never speakable
+            # prose — fall back to the canned reply and make sure the
+            # garbage turn is not cached for replay
+            logger.warning(f"Fused response parse failed for call {call_sid}: {exc}")
+            ai_response = "I'm sorry, I'm experiencing technical difficulties. Please call back later."
+            cache_embedding = None
 
-Your capabilities:
-1. Make reservations (collect details step by step: name & phone first, then party size, then date & time)
-2. Answer questions about hours, menu, location, special features
-3. Provide excellent service - be friendly and professional
-4. Handle reservation changes and cancellations
-5. Offer alternatives if requested time isn't available
-6. Ask for SMS consent before sending confirmations
-7. Escalate to human if customer requests or if you're unsure after 2 attempts
+        # Add AI response to history
+        await _history_append(call_sid, {"role": "assistant", "content": ai_response})
 
-IMPORTANT CONVERSATION RULES:
-- Stay focused on the current task. Do NOT ask "Is there anything else I can help you with" unless the customer has completed their request.
-- For reservations, collect information step by step:
-  * First: Ask for name and phone number
-  * Second: Ask for party size
-  * Third: Ask for date and time
-  * Fourth: Ask for SMS consent for confirmation
-- Be formal and professional in tone
-- Only offer additional help when the current request is fully completed.
-- Be conversational and natural - don't sound robotic or repetitive.
+        # Populate the semantic cache for future paraphrases of this FAQ.
+        # Turns that complete a reservation are caller-specific and must
+        # never be replayed to someone else.
+        if cache_embedding is not None and not analysis.get("reservation_complete"):
+            semantic_cache.store(cache_embedding, ai_response, detected_language)
 
-RESERVATION FLOW EXAMPLES:
-- When someone says "I'd like to make a reservation": "I'd be happy to help you make a reservation. To get started, could you please provide your name and phone number?"
-- After getting name/phone: "Thank you. How many people will be in your party?"
-- After getting party size: "Perfect. What date and time would you prefer for your reservation?"
-- After getting date/time: "Excellent! Would you like me to send you a text message confirmation of your reservation?"
+        return ai_response, analysis
 
-SMS CONSENT:
-- Always ask for SMS consent after collecting all reservation details
-- If customer says yes: "Perfect! I'll send you a confirmation text. Your reservation is confirmed for [date] at [time] for [party_size] people. Thank you for choosing [restaurant_name]!"
-- If customer says no: "No problem! Your reservation is confirmed for [date] at [time] for [party_size] people. Thank you for choosing [restaurant_name]!"
+    except asyncio.TimeoutError:
+        # Surfaced to the webhook handler, which answers with a filler
+        # prompt and re-gathers instead of dropping the call
+        raise
+    except Exception as e:
+        logger.error(f"Error generating AI response: {e}")
+        return "I'm sorry, I'm experiencing technical difficulties. Please call back later.", analysis
 
-Current conversation context: {len(history)} previous exchanges.
 
-Respond naturally and conversationally. Keep responses concise but helpful."""
+# Bursts of webhook deliveries from the same call (barge-in, rapid
+# clarifications, Twilio retries) within this window share one LLM call
+_COALESCE_WINDOW = 0.1  # seconds
+_pending_turns: Dict[str, dict] = {}
 
-        # Prepare messages for OpenAI
-        messages = [{"role": "system", "content": system_prompt}] + history
-        
-        # Call OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=150,
-            temperature=0.7
-        )
-        
-        ai_response = response.choices[0].message.content.strip()
-        
-        # Add AI response to history
-        history.append({"role": "assistant", "content": ai_response})
-        call_history[call_sid] = history
-        
-        return ai_response
-        
-    except Exception as e:
-        logger.error(f"Error generating AI response: {e}")
-        return "I'm sorry, I'm experiencing technical difficulties. Please call back later."
 
-def analyze_interaction(user_message: str, ai_message: str) -> dict:
-    """Lightweight analyzer using OpenAI to extract intent, reservation completion, and SMS consent.
+async def _generate_with_coalescing(user_message: str, call_sid: str, text_lower: Optional[str] = None) -> tuple:
+    """Share a single LLM round-trip across a burst of utterances.
 
-    Returns dict like:
-    {
-      "reservation_complete": bool,
-      "sms_consent": "yes"|"no"|"unknown",
-      "details": {"name": str|None, "phone": str|None, "party_size": int|None, "date": str|None, "time": str|None}
-    }
+    The first utterance of a burst opens a short window; peers landing
+    inside it are folded into the same request (prefilling the system
+    prompt once) and every waiter gets the fused reply. First turns skip
+    the window since there is no latency budget to spend on one.
     """
+    batch = _pending_turns.get(call_sid)
+    if batch is not None:
+        batch["texts"].append(user_message)
+        return await batch["future"]
+
+    if not await _history_get(call_sid):
+        return await generate_ai_response(user_message, call_sid, text_lower)
+
+    batch = {"texts": [user_message], "future": asyncio.get_running_loop().create_future()}
+    _pending_turns[call_sid] = batch
     try:
-        if not OPENAI_API_KEY:
-            return {"reservation_complete": False, "sms_consent": "unknown", "details": {}}
+        await asyncio.sleep(_COALESCE_WINDOW)
+    finally:
+        _pending_turns.pop(call_sid, None)
 
-        system = (
-            "You extract structured data from a restaurant phone conversation. "
-            "Return strict JSON only."
-        )
-        instruction = (
-            "Given the last user message and the assistant reply, decide if a reservation is completed, "
-            "and whether the caller consented to SMS. "
-            "Output JSON with keys: reservation_complete (boolean), sms_consent ('yes'|'no'|'unknown'), "
-            "and details {name, phone, party_size, date, time}. If unknown, use null."
-        )
-        messages = [
-            {"role": "system", "content": system},
-            {"role": "user", "content": instruction},
-            {
-                "role": "user",
-                "content": json.dumps(
-                    {"user_message": user_message, "assistant_message": ai_message}
-                ),
-            },
-        ]
-        resp = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0,
-            max_tokens=200,
-        )
-        raw = resp.choices[0].message.content.strip()
-        # Ensure pure JSON
-        start = raw.find("{")
-        end = raw.rfind("}")
-        if start != -1 and end != -1:
-            raw = raw[start : end + 1]
-        parsed = json.loads(raw)
-        # Basic shape guard
-        if "reservation_complete" not in parsed or "sms_consent" not in parsed:
-            raise ValueError("missing keys")
-        return parsed
-    except Exception as exc:
-        logger.warning(f"analyze_interaction fallback: {exc}")
-        return {"reservation_complete": False, "sms_consent": "unknown", "details": {}}
-def text_to_speech(text: str) -> str:
-    """Convert text to speech using ElevenLabs"""
+    if len(batch["texts"]) == 1:
+        return await generate_ai_response(user_message, call_sid, text_lower)
+
+    combined = "\n".join(batch["texts"])
     try:
-        if not ELEVENLABS_API_KEY:
-            # Fallback to Twilio TTS
-            return text
-        
-        # Use ElevenLabs for high-quality TTS
-        audio = generate(
+        result = await generate_ai_response(combined, call_sid, combined.lower())
+    except Exception as e:
+        if not batch["future"].done():
+            batch["future"].set_exception(e)
+        raise
+    if not batch["future"].done():
+        batch["future"].set_result(result)
+    return result
+# Directory for streamed TTS audio that Twilio fetches back via <Play>
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts_cache"))
+os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+
+# Twilio fetches the <Play> URL within seconds of receiving the TwiML, so
+# audio files are short-lived; the periodic sweep keeps the cache directory
+# from growing without bound in a long-running process.
+_AUDIO_TTL = 600  # seconds
+_AUDIO_SWEEP_INTERVAL = 300  # seconds
+_AUDIO_FIRST_CHUNK_TIMEOUT = 2.0  # seconds
+_audio_sweep_lock = threading.Lock()
+_audio_last_sweep = 0.0
+
+
+def _sweep_audio_cache():
+    """Delete audio files past their TTL (runs in the synthesis thread)."""
+    global _audio_last_sweep
+    now = time.time()
+    with _audio_sweep_lock:
+        if now - _audio_last_sweep < _AUDIO_SWEEP_INTERVAL:
+            return
+        _audio_last_sweep = now
+    cutoff = now - _AUDIO_TTL
+    try:
+        for entry in os.scandir(AUDIO_CACHE_DIR):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass  # Another worker may have swept it already
+    except OSError as e:
+        logger.warning(f"Audio cache sweep failed: {e}")
+
+
+def _synthesize_to_file(text: str, audio_path: str, first_chunk: threading.Event):
+    """Worker thread: stream ElevenLabs audio chunks into the cache file.
+
+    first_chunk is set once audio bytes actually exist (never on failure),
+    so the TwiML side can fall back to <Say> instead of pointing <Play> at
+    an empty file. A .done marker tells /audio that no more bytes are
+    coming.
+    """
+    _sweep_audio_cache()
+    try:
+        audio_stream = generate(
             text=text,
             voice="Rachel",  # Natural female voice
-            model="eleven_monolingual_v1"
+            model="eleven_monolingual_v1",
+            stream=True
         )
-        
-        # For now, return the text (Twilio will handle TTS)
-        # In production, you would save the audio and return the URL
-        return text
-        
+        with open(audio_path, "ab") as audio_file:
+            for chunk in audio_stream:
+                if chunk:
+                    audio_file.write(chunk)
+                    audio_file.flush()
+                    first_chunk.set()
+    except Exception as e:
+        logger.error(f"Error in text-to-speech: {e}")
+    finally:
+        open(audio_path + ".done", "wb").close()
+
+
+def text_to_speech(text: str):
+    """Start ElevenLabs synthesis in the background.
+
+    Returns (audio_url, first_chunk_event), or (None, None) when
+    ElevenLabs is not configured. The TwiML goes back to Twilio
+    immediately; when Twilio fetches the <Play> URL, /audio streams the
+    file while the worker thread is still appending to it, so the caller
+    hears the first chunk instead of waiting for the whole MP3.
+    """
+    try:
+        if not ELEVENLABS_API_KEY:
+            # Fallback to Twilio TTS
+            return None, None
+
+        audio_name = f"{uuid.uuid4().hex}.mp3"
+        audio_path = os.path.join(AUDIO_CACHE_DIR, audio_name)
+        # Create the file up front so the URL is valid before the worker runs
+        open(audio_path, "wb").close()
+        first_chunk = threading.Event()
+        threading.Thread(
+            target=_synthesize_to_file, args=(text, audio_path, first_chunk), daemon=True
+        ).start()
+
+        return f"/audio/{audio_name}", first_chunk
+
     except Exception as e:
         logger.error(f"Error in text-to-speech: {e}")
-        return text
+        return None, None
+
+
+async def _speech_element(text: str) -> str:
+    """TwiML fragment that speaks `text`: streamed <Play> audio when
+    ElevenLabs is configured, Twilio's built-in <Say> TTS otherwise.
+
+    Synthesis starts here, so callers should only render this on branches
+    whose TwiML actually plays the reply. <Play> is only emitted once the
+    first audio chunk has arrived; a failed or stalled stream falls back
+    to <Say> so the caller still hears the reply.
+    """
+    audio_url, first_chunk = text_to_speech(text)
+    if audio_url is not None:
+        if await asyncio.to_thread(first_chunk.wait, _AUDIO_FIRST_CHUNK_TIMEOUT):
+            return f"<Play>{audio_url}</Play>"
+        logger.warning("TTS produced no audio in time; falling back to <Say>")
+    return f"<Say>{html.escape(text)}</Say>"
+
+
+async def _tail_audio(audio_path: str, timeout: float = 30.0):
+    """Yield audio bytes as the synthesis worker writes them"""
+    done_path = audio_path + ".done"
+    deadline = time.monotonic() + timeout
+    offset = 0
+    while True:
+        with open(audio_path, "rb") as audio_file:
+            audio_file.seek(offset)
+            chunk = audio_file.read(65536)
+        if chunk:
+            offset += len(chunk)
+            yield chunk
+            continue
+        if os.path.exists(done_path) or time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.05)
+
+
+@app.get("/audio/{audio_name}")
+async def serve_audio(audio_name: str):
+    """Serve streamed TTS audio referenced from <Play> in our TwiML."""
+    if not re.fullmatch(r"[0-9a-f]{32}\.mp3", audio_name):
+        return _json_response({"error": "Audio not found"}, status_code=404)
+
+    audio_path = os.path.join(AUDIO_CACHE_DIR, audio_name)
+    if not os.path.exists(audio_path):
+        return _json_response({"error": "Audio not found"}, status_code=404)
+
+    return StreamingResponse(_tail_audio(audio_path), media_type="audio/mpeg")
+
+# Fully static endpoint payloads, encoded once at import time
+_ROOT_BYTES = _json_dumps({
+    "message": f"Welcome to {RESTAURANT_INFO['name']} AI Agent",
+    "status": "operational",
+    "version": "1.0.0"
+}).encode()
+
+_TEST_BYTES = _json_dumps({
+    "message": "API is working!",
+    "restaurant": RESTAURANT_INFO['name'],
+    "status": "operational"
+}).encode()
+
+
+async def _warm_upstream():
+    """Prime vendor connections and the DB pool off the readiness path.
+
+    The keyword automata and regexes are already compiled at import; what
+    still stalls the first real call is the initial TLS handshake to OpenAI
+    and the first pooled DB connection, so both are paid here instead.
+    """
+    if openai_async_client is not None:
+        try:
+            await openai_async_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1,
+            )
+        except Exception as e:
+            logger.warning(f"OpenAI warmup failed: {e}")
+    if engine is not None:
+        try:
+            await asyncio.to_thread(lambda: engine.connect().close())
+        except Exception as e:
+            logger.warning(f"Database warmup failed: {e}")
+
+
+@app.on_event("startup")
+async def warmup():
+    # The async Redis client can only be pinged once a loop is running; a
+    # failed ping downgrades to the in-memory fallbacks for the process
+    global redis_client
+    if redis_client is not None:
+        try:
+            await redis_client.ping()
+            logger.info("Redis connection established")
+        except Exception as e:
+            logger.warning(f"Redis connection failed, using in-memory state: {e}")
+            redis_client = None
+
+    # Scheduled as a task so readiness is not blocked on vendor round-trips
+    asyncio.create_task(_warm_upstream())
+
 
 @app.get("/")
 def root():
     """Root endpoint"""
-    return {
-        "message": f"Welcome to {RESTAURANT_INFO['name']} AI Agent",
-        "status": "operational",
-        "version": "1.0.0"
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 @app.get("/health")
 def health():
@@ -915,6 +1847,89 @@ def health():
         "uptime": "ok"
     }
 
+# TwiML documents rendered once at import. Only the spoken reply and the
+# validation message vary per turn; dynamic slots are XML-escaped at
+# substitution time (a caller-supplied "<" would otherwise break the
+# document). Everything else is a byte-for-byte constant.
+_RESTAURANT_NAME_XML = html.escape(RESTAURANT_INFO['name'])
+
+_TWIML_RATE_LIMITED = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>I'm sorry, but you have exceeded the maximum number of calls allowed. Please try again later.</Say>
+    <Hangup/>
+</Response>"""
+
+_TWIML_GREETING = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>Thank you for calling {_RESTAURANT_NAME_XML}! I'm your AI assistant. How can I help you today?</Say>
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>Please tell me what you'd like to do. You can say things like "I'd like to make a reservation" or "What are your hours?"</Say>
+    </Gather>
+    <Say>I didn't hear anything. Please call back and I'll be happy to help you!</Say>
+    <Hangup/>
+</Response>"""
+
+_TWIML_ACCOUNT_BLOCKED = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>I'm sorry, but this number has been blocked due to repeated policy violations. Goodbye.</Say>
+    <Hangup/>
+</Response>"""
+
+_TWIML_CONTENT_BLOCKED = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>I'm sorry, but I can't process that request. Please keep our conversation professional and appropriate.</Say>
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>How else can I help you today?</Say>
+    </Gather>
+    <Hangup/>
+</Response>"""
+
+_TWIML_CLARIFY = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>I'm sorry, I didn't catch that. Could you please repeat what you said?</Say>
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>Please tell me what you'd like to do.</Say>
+    </Gather>
+    <Say>I'm still having trouble understanding. Please call back and I'll be happy to help!</Say>
+    <Hangup/>
+</Response>"""
+
+_TWIML_BUSY = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>One moment please, I'm still working on that.</Say>
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>Please go ahead whenever you're ready.</Say>
+    </Gather>
+    <Hangup/>
+</Response>"""
+
+_TWIML_RESERVATION_INVALID = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say>{error_msg}</Say>
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>How else can I help you today?</Say>
+    </Gather>
+    <Hangup/>
+</Response>"""
+
+_TWIML_RESERVATION_DONE = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    {speech_element}
+    <Say>Thank you for choosing """ + _RESTAURANT_NAME_XML + """. Have a great day!</Say>
+    <Hangup/>
+</Response>"""
+
+_TWIML_CONTINUE = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    {speech_element}
+    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
+        <Say>Is there anything else I can help you with?</Say>
+    </Gather>
+    <Say>Thank you for calling """ + _RESTAURANT_NAME_XML + """. Have a great day!</Say>
+    <Hangup/>
+</Response>"""
+
+
 @app.post("/voice/")
 async def handle_call(request: Request):
     """Handle incoming call"""
@@ -925,34 +1940,17 @@ async def handle_call(request: Request):
 
     logger.info(f"New call received: {call_sid} from {from_number}")
 
-    # Log call start to database
-    log_call_start(call_sid, from_number, to_number)
+    # Log call start to database. Stays a synchronous write (later turns
+    # need the call id), but runs in the thread pool so a slow checkout
+    # doesn't stall every concurrent webhook on the event loop
+    await asyncio.to_thread(log_call_start, call_sid, from_number, to_number)
 
     # Security check: Rate limiting
-    if is_rate_limited(from_number):
+    if await is_rate_limited(from_number):
         logger.warning(f"Call blocked due to rate limiting: {from_number}")
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>I'm sorry, but you have exceeded the maximum number of calls allowed. Please try again later.</Say>
-    <Hangup/>
-</Response>"""
-        return Response(content=twiml, media_type="application/xml")
+        return Response(content=_TWIML_RATE_LIMITED, media_type="application/xml")
 
-    # Initialize call history
-    if call_sid not in call_history:
-        call_history[call_sid] = []
-    
-    twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>Thank you for calling {RESTAURANT_INFO['name']}! I'm your AI assistant. How can I help you today?</Say>
-    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
-        <Say>Please tell me what you'd like to do. You can say things like "I'd like to make a reservation" or "What are your hours?"</Say>
-    </Gather>
-    <Say>I didn't hear anything. Please call back and I'll be happy to help you!</Say>
-    <Hangup/>
-</Response>"""
-    
-    return Response(content=twiml, media_type="application/xml")
+    return Response(content=_TWIML_GREETING, media_type="application/xml")
 
 @app.post("/voice/process")
 async def process_speech(request: Request):
@@ -965,62 +1963,54 @@ async def process_speech(request: Request):
     
     logger.info(f"Processing speech for call {call_sid}: '{speech_result}' (confidence: {confidence})")
 
+    # Parse Twilio's confidence string exactly once per turn; the transcript
+    # log and the low-confidence branch both reuse the parsed value
+    try:
+        confidence_value = float(confidence) if confidence else None
+    except (TypeError, ValueError):
+        confidence_value = None
+
     # Log user transcript
-    log_transcript(call_sid, "customer", speech_result, float(confidence) if confidence else None)
+    log_transcript(call_sid, "customer", speech_result, confidence_value)
+
+    # Lowercase the utterance once; moderation and language detection reuse it
+    speech_lower = speech_result.lower()
 
     # Content moderation check
-    is_safe, block_reason = moderate_content(speech_result, from_number)
+    is_safe, block_reason = await moderate_content(speech_result, from_number, speech_lower)
     if not is_safe:
         logger.warning(f"Content blocked for {from_number}: {block_reason}")
         
         if block_reason == "account_blocked":
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>I'm sorry, but this number has been blocked due to repeated policy violations. Goodbye.</Say>
-    <Hangup/>
-</Response>"""
+            twiml = _TWIML_ACCOUNT_BLOCKED
         else:
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>I'm sorry, but I can't process that request. Please keep our conversation professional and appropriate.</Say>
-    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
-        <Say>How else can I help you today?</Say>
-    </Gather>
-    <Hangup/>
-</Response>"""
+            twiml = _TWIML_CONTENT_BLOCKED
         return Response(content=twiml, media_type="application/xml")
     
     # If no speech detected or low confidence, ask for clarification
-    if not speech_result or float(confidence) < 0.5:
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>I'm sorry, I didn't catch that. Could you please repeat what you said?</Say>
-    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
-        <Say>Please tell me what you'd like to do.</Say>
-    </Gather>
-    <Say>I'm still having trouble understanding. Please call back and I'll be happy to help!</Say>
-    <Hangup/>
-</Response>"""
-        return Response(content=twiml, media_type="application/xml")
+    if not speech_result or (confidence_value or 0.0) < 0.5:
+        return Response(content=_TWIML_CLARIFY, media_type="application/xml")
     
-    # Generate AI response
-    ai_response = generate_ai_response(speech_result, call_sid)
+    # Generate AI response and per-turn analysis in one round-trip;
+    # bursts from the same call coalesce into a single LLM request
+    try:
+        ai_response, analysis = await _generate_with_coalescing(speech_result, call_sid, speech_lower)
+    except asyncio.TimeoutError:
+        # Upstream is saturated; stall politely and re-gather rather than
+        # holding the webhook open past Twilio's own timeout
+        logger.warning(f"LLM call timed out for call {call_sid}; sending filler prompt")
+        return Response(content=_TWIML_BUSY, media_type="application/xml")
 
     # Log AI response
     log_transcript(call_sid, "ai", ai_response)
 
-    # Analyze exchange for reservation completion and consent
-    analysis = analyze_interaction(speech_result, ai_response)
     last_analysis[call_sid] = analysis
-    
-    # Convert to speech (for now, using Twilio TTS)
-    speech_text = text_to_speech(ai_response)
-    
+
     # Check if this is a reservation completion
     if analysis.get("reservation_complete", False):
         # Validate reservation data
         reservation_data = analysis.get("details", {})
-        is_valid, validation_error = validate_reservation_data(reservation_data, from_number)
+        is_valid, validation_error = await validate_reservation_data(reservation_data, from_number)
         
         if not is_valid:
             logger.warning(f"Reservation validation failed for {from_number}: {validation_error}")
@@ -1032,44 +2022,38 @@ async def process_speech(request: Request):
             else:
                 error_msg = "I'm sorry, but I cannot process this reservation at the moment. Please try again later."
             
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>{error_msg}</Say>
-    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
-        <Say>How else can I help you today?</Say>
-    </Gather>
-    <Hangup/>
-</Response>"""
+            twiml = _TWIML_RESERVATION_INVALID.format(error_msg=error_msg)
         else:
-            # Mark reservation time for cooldown
-            if from_number not in reservation_state:
-                reservation_state[from_number] = {}
-            reservation_state[from_number]['last_reservation_time'] = time.time()
-            
-            # Log reservation to database
-            log_reservation(call_sid, reservation_data)
+            # A retried webhook delivery must not double-book: only the first
+            # delivery for this call records the reservation
+            if await _idempotency_claim(f"reservation:{call_sid}"):
+                # Mark reservation time for cooldown
+                await _mark_reservation(from_number)
+
+                # Log reservation to database
+                log_reservation(call_sid, reservation_data)
             
             # End call after successful reservation confirmation
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>{speech_text}</Say>
-    <Say>Thank you for choosing {RESTAURANT_INFO['name']}. Have a great day!</Say>
-    <Hangup/>
-</Response>"""
+            twiml = _TWIML_RESERVATION_DONE.format(speech_element=await _speech_element(ai_response))
     else:
         # Continue conversation
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>{speech_text}</Say>
-    <Gather input="speech" action="/voice/process" method="POST" speechTimeout="auto" speechModel="phone_call">
-        <Say>Is there anything else I can help you with?</Say>
-    </Gather>
-    <Say>Thank you for calling {RESTAURANT_INFO['name']}. Have a great day!</Say>
-    <Hangup/>
-</Response>"""
+        twiml = _TWIML_CONTINUE.format(speech_element=await _speech_element(ai_response))
     
     return Response(content=twiml, media_type="application/xml")
 
+@app.post("/voice/status")
+async def call_status(request: Request):
+    """Twilio status callback: finalize call logging and free per-call state"""
+    form_data = await request.form()
+    call_sid = form_data.get("CallSid", "unknown")
+    status = form_data.get("CallStatus", "")
+
+    if status in ("completed", "busy", "failed", "no-answer", "canceled"):
+        log_call_end(call_sid)
+        await _history_clear(call_sid)
+
+    return {"status": "ok"}
+
 @app.get("/analysis/{call_sid}")
 def get_last_analysis(call_sid: str):
     """Return the most recent analyzer output for a call (for validation)."""
@@ -1078,11 +2062,7 @@ def get_last_analysis(call_sid: str):
 @app.get("/test")
 def test():
     """Test endpoint"""
-    return {
-        "message": "API is working!",
-        "restaurant": RESTAURANT_INFO['name'],
-        "status": "operational"
-    }
+    return Response(content=_TEST_BYTES, media_type="application/json")
 
 @app.get("/sms/status")
 def sms_status():
@@ -1098,46 +2078,54 @@ def sms_status():
 class SMSRequest(BaseModel):
     to: str
     message: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
 @app.post("/sms/send")
-def sms_send(payload: SMSRequest):
+async def sms_send(payload: SMSRequest):
     """Send an SMS if Twilio is properly configured; otherwise return 503.
 
     This is intentionally minimal and safe: no send unless env/imports are ready.
     """
     client = get_twilio_client()
     if client is None:
-        return JSONResponse(
-            status_code=503,
-            content={
+        return _json_response(
+            {
                 "error": "SMS subsystem not ready",
                 "twilio_import": _twilio_import_ok,
                 "twilio_env_ready": bool(
                     TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_PHONE_NUMBER
                 ),
             },
+            status_code=503,
         )
 
+    # Short-circuit duplicate sends (e.g. client or webhook retries)
+    if payload.idempotency_key and not await _idempotency_claim(f"sms:{payload.idempotency_key}"):
+        return {"status": "duplicate"}
+
     text = payload.message or f"Hello from {RESTAURANT_INFO['name']}!"
     try:
-        msg = client.messages.create(
+        # The Twilio SDK is synchronous; run the round-trip in the thread
+        # pool so the event loop keeps serving webhooks meanwhile
+        msg = await asyncio.to_thread(
+            client.messages.create,
             from_=TWILIO_PHONE_NUMBER,
             to=payload.to,
             body=text,
         )
         return {"status": "queued", "sid": msg.sid}
     except Exception as exc:
-        return JSONResponse(status_code=502, content={"error": str(exc)})
+        return _json_response({"error": str(exc)}, status_code=502)
 
 @app.get("/test-ai")
-def test_ai():
+async def test_ai():
     """Test AI functionality"""
     try:
         if not OPENAI_API_KEY:
             return {"error": "OpenAI API key not found"}
-        
+
         # Test AI response
-        test_response = generate_ai_response("What are your hours?", "test-call")
+        test_response, _ = await generate_ai_response("What are your hours?", "test-call")
         
         return {
             "test_response": test_response,
@@ -1147,16 +2135,43 @@ def test_ai():
         return {"error": str(e)}
 
 @app.get("/security/status")
-def security_status():
+async def security_status():
     """Get security monitoring dashboard"""
+    blocked = list(blocked_numbers)
+    flags = dict(moderation_flags)
+    rate_limited = len([
+        phone for phone, calls in call_rate_limit.items()
+        if len(calls) >= MAX_CALLS_PER_HOUR
+    ])
+    if redis_client is not None:
+        # On the Redis path the in-process structures stay empty, so the
+        # dashboard reads the shared state: a SCAN per key family plus one
+        # MGET (fine for an admin endpoint)
+        try:
+            blocked = sorted(await redis_client.smembers(_BLOCKED_SET_KEY))
+
+            flag_keys = [key async for key in redis_client.scan_iter(match="mod_flags:*")]
+            flag_values = await redis_client.mget(flag_keys) if flag_keys else []
+            flags = {
+                key.split(":", 1)[1]: int(value)
+                for key, value in zip(flag_keys, flag_values)
+                if value is not None
+            }
+
+            hour = int(time.time() // 3600)
+            rl_keys = [key async for key in redis_client.scan_iter(match=f"rl:*:{hour}")]
+            rl_values = await redis_client.mget(rl_keys) if rl_keys else []
+            rate_limited = sum(
+                1 for value in rl_values
+                if value is not None and int(value) > MAX_CALLS_PER_HOUR
+            )
+        except Exception as e:
+            logger.warning(f"Redis security-state read failed: {e}")
     return {
-        "blocked_numbers": list(blocked_numbers),
-        "total_blocked": len(blocked_numbers),
-        "rate_limited_numbers": len([
-            phone for phone, calls in call_rate_limit.items() 
-            if len(calls) >= MAX_CALLS_PER_HOUR
-        ]),
-        "moderation_flags": dict(moderation_flags),
+        "blocked_numbers": blocked,
+        "total_blocked": len(blocked),
+        "rate_limited_numbers": rate_limited,
+        "moderation_flags": flags,
         "settings": {
             "max_calls_per_hour": MAX_CALLS_PER_HOUR,
             "max_moderation_flags": MAX_MODERATION_FLAGS,
@@ -1173,9 +2188,18 @@ async def unblock_number(request: Request):
     if not phone_number:
         return {"error": "phone_number required"}
     
-    if phone_number in blocked_numbers:
-        blocked_numbers.remove(phone_number)
-        moderation_flags[phone_number] = 0
+    removed = phone_number in blocked_numbers
+    blocked_numbers.pop(phone_number, None)
+    moderation_flags.pop(phone_number, None)
+    if redis_client is not None:
+        try:
+            removed = await redis_client.srem(_BLOCKED_SET_KEY, phone_number) > 0
+            await redis_client.delete(f"mod_flags:{phone_number}")
+        except Exception as e:
+            logger.warning(f"Redis unblock failed: {e}")
+        _blocked_local.pop(phone_number, None)
+
+    if removed:
         logger.info(f"Unblocked phone number: {phone_number}")
         return {"message": f"Phone number {phone_number} has been unblocked"}
     else:
@@ -1198,18 +2222,20 @@ def analytics_dashboard():
         return {"error": "Database connection failed"}
     
     try:
-        # Call statistics
-        total_calls = db.query(Call).count()
-        completed_calls = db.query(Call).filter(Call.status == "completed").count()
-        in_progress_calls = db.query(Call).filter(Call.status == "in-progress").count()
-        
-        # Reservation statistics
-        total_reservations = db.query(Reservation).count()
-        confirmed_reservations = db.query(Reservation).filter(Reservation.status == "confirmed").count()
-        
-        # SMS consent statistics
-        sms_consent_given = db.query(Reservation).filter(Reservation.sms_consent == True).count()
-        
+        # One aggregate query per table (two round-trips, one scan each)
+        # instead of six separate SELECT COUNT(*) statements
+        total_calls, completed_calls, in_progress_calls = db.query(
+            func.count(Call.id),
+            func.coalesce(func.sum(case((Call.status == "completed", 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Call.status == "in-progress", 1), else_=0)), 0),
+        ).one()
+
+        total_reservations, confirmed_reservations, sms_consent_given = db.query(
+            func.count(Reservation.id),
+            func.coalesce(func.sum(case((Reservation.status == "confirmed", 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Reservation.sms_consent == True, 1), else_=0)), 0),
+        ).one()
+
         return {
             "database_status": "available",
             "call_stats": {
@@ -1241,7 +2267,15 @@ def get_calls(limit: int = 50):
         return {"error": "Database connection failed"}
     
     try:
-        calls = db.query(Call).order_by(Call.start_time.desc()).limit(limit).all()
+        # selectinload batches the children into one query per relationship;
+        # lazy loading would issue two SELECTs per call row (N+1)
+        calls = (
+            db.query(Call)
+            .options(selectinload(Call.transcripts), selectinload(Call.reservations))
+            .order_by(Call.start_time.desc())
+            .limit(limit)
+            .all()
+        )
         result = []
         
         for call in calls:
@@ -1273,7 +2307,12 @@ def get_call_details(call_sid: str):
         return {"error": "Database connection failed"}
     
     try:
-        call = db.query(Call).filter(Call.call_sid == call_sid).first()
+        call = (
+            db.query(Call)
+            .options(selectinload(Call.transcripts), selectinload(Call.reservations))
+            .filter(Call.call_sid == call_sid)
+            .first()
+        )
         if not call:
             return {"error": "Call not found"}
         
@@ -1321,12 +2360,19 @@ def get_call_details(call_sid: str):
         db.close()
 
 @app.get("/debug")
-def debug():
+async def debug():
     """Debug endpoint to check environment"""
     db_status = "not_configured"
     if DATABASE_URL:
         db_status = "available" if DATABASE_AVAILABLE else "failed"
-    
+
+    total_blocked = len(blocked_numbers)
+    if redis_client is not None:
+        try:
+            total_blocked = await redis_client.scard(_BLOCKED_SET_KEY)
+        except Exception as e:
+            logger.warning(f"Redis blocked-set count failed: {e}")
+
     return {
         "openai_key_set": bool(OPENAI_API_KEY),
         "elevenlabs_key_set": bool(ELEVENLABS_API_KEY),
@@ -1337,12 +2383,32 @@ def debug():
         "call_history_count": len(call_history),
         "reservations_count": len(reservations),
         "security_stats": {
-            "blocked_numbers": len(blocked_numbers),
+            "blocked_numbers": total_blocked,
             "moderation_flags": len(moderation_flags)
+        },
+        "db_write_queue": {
+            "pending": _db_queue.qsize(),
+            "dropped": _db_dropped_writes
         }
     }
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # uvloop + httptools replace the stdlib event loop and h11 parser; the
+    # webhook handlers are I/O-bound, so workers scale across cores — but
+    # only once call state is shared through Redis. Without USE_REDIS the
+    # history, rate limits and idempotency claims are per-process, and
+    # consecutive webhooks for one call would land on different workers,
+    # so the default stays single-worker. proxy_headers keeps the real
+    # client address visible behind the platform's load balancer.
+    uvicorn.run(
+        "app_simple:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "4" if USE_REDIS else "1")),
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+    )
\ No newline at end of file